@@ -0,0 +1,51 @@
+"""
+微基准：FileChatMessageHistory（整文件读写 JSON）vs JsonlChatMessageHistory（追加写 + 尾部索引）
+每一轮模拟 RunnableWithMessageHistory 的一次对话：读取历史 + 追加一问一答两条消息。
+
+运行方式：python 260129/benchChatHistory.py
+"""
+import json
+import os
+import tempfile
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict
+
+# readFromFile 在导入时会创建 ChatTongyi 对象（只校验参数，不发请求），这里给一个占位 Key
+os.environ.setdefault("DASHSCOPE_API_KEY", "sk-benchmark-placeholder")
+from readFromFile import FileChatMessageHistory
+from jsonlChatHistory import JsonlChatMessageHistory
+
+
+def make_messages(n: int) -> list:
+    return [HumanMessage(content=f"问题 {i}") if i % 2 == 0 else AIMessage(content=f"回答 {i}") for i in range(n)]
+
+
+def prepare_file_history(store_path: str, n: int) -> FileChatMessageHistory:
+    history = FileChatMessageHistory("file_session", store_path)
+    with open(history.file_path, "w", encoding="utf-8") as f:
+        json.dump([message_to_dict(m) for m in make_messages(n)], f, ensure_ascii=False)
+    return history
+
+
+def prepare_jsonl_history(store_path: str, n: int) -> JsonlChatMessageHistory:
+    history = JsonlChatMessageHistory("jsonl_session", store_path, window=10)
+    history.add_messages(make_messages(n))
+    return history
+
+
+def per_turn_ms(history, turns: int) -> float:
+    start = time.perf_counter()
+    for i in range(turns):
+        _ = history.messages
+        history.add_messages([HumanMessage(content=f"新问题 {i}"), AIMessage(content=f"新回答 {i}")])
+    return (time.perf_counter() - start) * 1000 / turns
+
+
+if __name__ == "__main__":
+    print(f"{'历史条数':>10} {'File (ms/轮)':>14} {'JSONL (ms/轮)':>14}")
+    for n, turns in ((10, 200), (1_000, 100), (100_000, 5)):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_ms = per_turn_ms(prepare_file_history(tmp, n), turns)
+            jsonl_ms = per_turn_ms(prepare_jsonl_history(tmp, n), turns)
+        print(f"{n:>10} {file_ms:>14.3f} {jsonl_ms:>14.3f}")
@@ -0,0 +1,149 @@
+from langchain_core.messages import message_to_dict, messages_from_dict, BaseMessage
+from typing import Optional, Sequence
+from langchain_core.chat_history import BaseChatMessageHistory
+from filelock import FileLock
+import os, json, struct
+
+# 索引文件中每条记录是一个 8 字节小端无符号整数：对应消息在 .jsonl 中的起始偏移
+_OFFSET = struct.Struct("<Q")
+
+
+class JsonlChatMessageHistory(BaseChatMessageHistory):
+    """Append-only chat message history stored as JSON Lines.
+
+    - 每条消息一行追加写入 `<session_id>.jsonl`，不再整文件重写
+    - `<session_id>.idx` 记录每行的起始偏移，读取最近 N 条只需 seek 到索引末尾，O(N) 与历史长度无关
+    - 消息总数超过 `max_messages` 的两倍时压缩，只保留最近 `max_messages` 条（均摊 O(1)）
+    - 所有读写都在文件锁内进行，多进程/多 worker 共享同一目录也是安全的
+    - 只读取索引覆盖的数据：写入数据后、写入索引前崩溃留下的残行会被忽略，并在下次追加前截掉
+    """
+
+    def __init__(self, session_id: str, store_path: str, window: Optional[int] = None,
+                 max_messages: Optional[int] = None):
+        """
+        window: `messages` 只返回最近 window 条，None 表示返回全部
+        max_messages: 保留的最大消息数，None 表示永不压缩
+        """
+        self.session_id = session_id
+        self.store_path = store_path
+        self.window = window
+        self.max_messages = max_messages
+        base = os.path.join(self.store_path, self.session_id)
+        self.file_path = base + ".jsonl"
+        self.index_path = base + ".idx"
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self._lock = FileLock(base + ".lock")
+        with self._lock:
+            self._repair_index()
+
+    def _repair_index(self) -> None:
+        """Drop a torn or dangling tail from the index (caller holds the lock)."""
+        # 写索引中途崩溃会留下不足 8 字节的残片，之后追加的偏移全部错位：
+        # 先截到 8 字节整数倍，再从末尾去掉不指向数据文件中完整行首的偏移
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return
+        valid = size // _OFFSET.size
+        if valid and os.path.exists(self.file_path):
+            with open(self.index_path, "rb") as idx, open(self.file_path, "rb") as data:
+                while valid:
+                    idx.seek((valid - 1) * _OFFSET.size)
+                    (offset,) = _OFFSET.unpack(idx.read(_OFFSET.size))
+                    starts_line = True
+                    if offset > 0:
+                        data.seek(offset - 1)
+                        starts_line = data.read(1) == b"\n"
+                    data.seek(offset)
+                    if starts_line and data.readline().endswith(b"\n"):
+                        break
+                    valid -= 1
+        else:
+            valid = 0
+        if valid * _OFFSET.size != size:
+            with open(self.index_path, "r+b") as f:
+                f.truncate(valid * _OFFSET.size)
+
+    def _count(self) -> int:
+        try:
+            return os.path.getsize(self.index_path) // _OFFSET.size
+        except FileNotFoundError:
+            return 0
+
+    def _indexed_end(self, total: int) -> int:
+        """End offset of the last indexed line in the .jsonl file (caller holds the lock)."""
+        if total == 0:
+            return 0
+        with open(self.index_path, "rb") as f:
+            f.seek((total - 1) * _OFFSET.size)
+            (start,) = _OFFSET.unpack(f.read(_OFFSET.size))
+        with open(self.file_path, "rb") as f:
+            f.seek(start)
+            return start + len(f.readline())
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Append a single message."""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append messages to the log and their offsets to the index."""
+        lines = [(json.dumps(message_to_dict(m), ensure_ascii=False) + "\n").encode("utf-8") for m in messages]
+        with self._lock:
+            offsets = []
+            pos = self._indexed_end(self._count())
+            with open(self.file_path, "ab") as f:
+                # 截掉上次崩溃留下的、索引未覆盖的残行，保证新消息紧接在最后一条已索引消息之后
+                if f.seek(0, os.SEEK_END) > pos:
+                    f.truncate(pos)
+                for line in lines:
+                    offsets.append(pos)
+                    f.write(line)
+                    pos += len(line)
+            # 先写数据再写索引：中途崩溃时索引里不会出现指向不存在数据的偏移
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(_OFFSET.pack(o) for o in offsets))
+            if self.max_messages and self._count() > 2 * self.max_messages:
+                self._compact()
+
+    def _read_tail(self, n: Optional[int]) -> list[BaseMessage]:
+        """Read the last n messages (all when n is None) using the offset index."""
+        total = self._count()
+        if total == 0:
+            return []
+        skip = 0 if n is None else max(total - n, 0)
+        with open(self.index_path, "rb") as f:
+            f.seek(skip * _OFFSET.size)
+            (start,) = _OFFSET.unpack(f.read(_OFFSET.size))
+        end = self._indexed_end(total)
+        with open(self.file_path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        records = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+        return messages_from_dict(records)
+
+    def _compact(self) -> None:
+        """Rewrite the log keeping only the last max_messages messages (caller holds the lock)."""
+        keep = self._read_tail(self.max_messages)
+        tmp_file, tmp_index = self.file_path + ".tmp", self.index_path + ".tmp"
+        offsets, pos = [], 0
+        with open(tmp_file, "wb") as f:
+            for m in keep:
+                line = (json.dumps(message_to_dict(m), ensure_ascii=False) + "\n").encode("utf-8")
+                offsets.append(pos)
+                f.write(line)
+                pos += len(line)
+        with open(tmp_index, "wb") as f:
+            f.write(b"".join(_OFFSET.pack(o) for o in offsets))
+        os.replace(tmp_file, self.file_path)
+        os.replace(tmp_index, self.index_path)
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        """Return the last `window` messages (or all of them) as a plain list."""
+        with self._lock:
+            return self._read_tail(self.window)
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in (self.file_path, self.index_path):
+                open(path, "wb").close()
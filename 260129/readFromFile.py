@@ -7,6 +7,7 @@ from langchain_core.prompts import PromptTemplate   ,ChatPromptTemplate, Message
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.chat_history import InMemoryChatMessageHistory
+from jsonlChatHistory import JsonlChatMessageHistory
 
 class FileChatMessageHistory(BaseChatMessageHistory):
     """Chat message history that stores messages in a file."""
@@ -78,7 +79,9 @@ base_chain = prompt | model | str_parser
 store = {}
 
 def get_history(session_id: str) :
-    return FileChatMessageHistory(session_id, "./chat_history/")
+    # 追加写 + 尾部索引：每轮对话的读写成本与历史长度无关，且多进程安全
+    # （FileChatMessageHistory 每轮都要整文件读取并重写，保留作对比，见 benchChatHistory.py）
+    return JsonlChatMessageHistory(session_id, "./chat_history/", window=20, max_messages=1000)
 
 
 
@@ -0,0 +1,81 @@
+"""
+压测：每个请求重新构建 RAG 链 vs 启动时构建一次并缓存
+
+使用本地假 LLM / 假检索器，不访问 DashScope，只衡量链构建带来的额外开销。
+运行方式（在 RAG_V1 目录下）：
+    python benchmarks/bench_chain_cache.py --concurrency 200
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from core.rag_engine import RAGEngine
+
+
+class FakeVectorManager:
+    """只提供 get_retriever 的假向量库，固定返回 4 个片段"""
+
+    embeddings = None
+
+    def add_change_listener(self, callback):
+        pass
+
+    def get_retriever(self):
+        docs = [Document(page_content=f"示例片段 {i}", metadata={"file_name": "demo.txt"}) for i in range(4)]
+        return RunnableLambda(lambda _query: docs)
+
+
+async def run_requests(engine: RAGEngine, concurrency: int, rebuild: bool) -> list:
+    """并发发起 concurrency 个请求，返回每个请求的耗时（毫秒）"""
+    async def one_request(i: int) -> float:
+        start = time.perf_counter()
+        chain = engine._build_chain_with_source() if rebuild else engine.get_chain_with_source()
+        await chain.ainvoke(
+            {"input": f"问题 {rebuild}-{i}"}, # 每轮问题不同，避免命中答案缓存
+            config={"configurable": {"session_id": f"bench-{rebuild}-{i}"}},
+        )
+        return (time.perf_counter() - start) * 1000
+
+    return await asyncio.gather(*(one_request(i) for i in range(concurrency)))
+
+
+def measure_build(engine: RAGEngine, rounds: int) -> float:
+    """单独测量一次构建带来源链的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        engine._build_chain_with_source()
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def report(name: str, latencies: list, wall: float, concurrency: int):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<10} wall={wall:8.1f}ms  mean={statistics.mean(latencies):7.2f}ms  "
+          f"p50={statistics.median(latencies):7.2f}ms  p99={p99:7.2f}ms  qps={concurrency / wall * 1000:8.1f}")
+
+
+async def main(concurrency: int):
+    llm = FakeListChatModel(responses=["这是一个测试回答 [1]"])
+    engine = RAGEngine(llm=llm, vector_manager=FakeVectorManager())
+
+    print(f"单次构建带来源链耗时: {measure_build(engine, 50):.2f}ms")
+    for name, rebuild in (("per-request", True), ("cached", False)):
+        start = time.perf_counter()
+        latencies = await run_requests(engine, concurrency, rebuild)
+        report(name, latencies, (time.perf_counter() - start) * 1000, concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))
@@ -0,0 +1,79 @@
+"""
+验证 ModelFactory 共享连接池的连接复用情况：对本地桩服务发起若干次 Embedding 与 LLM 调用，
+对比请求数与实际建立的 TCP 连接数（无连接复用时两者相等）。
+运行方式（在 RAG_V1 目录下）：
+    python benchmarks/bench_connection_reuse.py --requests 50 --concurrency 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_dashscope import run_in_thread
+
+
+def configure(port: int):
+    # 必须在导入 core.config 之前设置，Settings 在导入时读取环境变量
+    os.environ.update({
+        "DASHSCOPE_API_KEY": "stub",
+        "LLM_API": "compatible",
+        "LLM_BASE_URL": f"http://127.0.0.1:{port}/compatible-mode/v1",
+        "DASHSCOPE_BASE_URL": f"http://127.0.0.1:{port}/api/v1",
+        "EMBEDDING_CACHE_ENABLED": "false",
+    })
+
+
+def stub_stats(port: int) -> dict:
+    return httpx.get(f"http://127.0.0.1:{port}/stats").json()
+
+
+async def run_async(requests: int, concurrency: int):
+    from core.model_factory import ModelFactory
+
+    embeddings, llm = ModelFactory.get_embedding(), ModelFactory.get_llm()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await embeddings.aembed_query(f"问题 {i}")
+            async for _ in llm.astream(f"问题 {i}"):
+                pass
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+
+
+def main(port: int, requests: int, concurrency: int):
+    configure(port)
+    run_in_thread(port)
+    from core.model_factory import ModelFactory
+
+    embeddings = ModelFactory.get_embedding()
+    start = time.perf_counter()
+    for i in range(requests):
+        embeddings.embed_query(f"问题 {i}")
+    sync_ms = (time.perf_counter() - start) * 1000
+    after_sync = stub_stats(port)
+    print(f"同步 Embedding: {requests} 次请求, {after_sync['connections']} 个连接, 耗时 {sync_ms:.1f}ms")
+
+    start = time.perf_counter()
+    asyncio.run(run_async(requests, concurrency))
+    async_ms = (time.perf_counter() - start) * 1000
+    final = stub_stats(port)
+    print(f"异步 Embedding + 流式 LLM (并发 {concurrency}): {final['requests'] - after_sync['requests']} 次请求, "
+          f"{final['connections'] - after_sync['connections']} 个新连接, 耗时 {async_ms:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    main(args.port, args.requests, args.concurrency)
@@ -0,0 +1,163 @@
+"""
+HNSW 参数基准：对比不同 M / construction_ef / search_ef / space 下的建索引耗时、单次查询延迟与召回率。
+召回率以 numpy 暴力计算的精确 top-k 为基准（recall@k = 近似结果与精确结果的交集 / k），
+只衡量索引本身的近似误差，与问题集、切片方式无关（端到端检索质量见 eval_retrieval.py）。
+
+默认使用带聚类结构的合成单位向量（比均匀随机向量更接近真实 Embedding 的分布），
+--source-dir 可改用已有 Chroma 目录中的真实向量，并从中抽出一部分作为查询。
+每组参数都新建 collection 并重新写入（search_ef 也在创建时指定，保证生效），不访问网络。
+运行方式（在 RAG_V1 目录下）：
+    python benchmarks/bench_hnsw.py --vectors 100000 --grid m=16,32 --grid search_ef=10,50,100,200
+    python benchmarks/bench_hnsw.py --source-dir ./data/chroma_db --grid construction_ef=100,200 --json-out hnsw.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--vectors", type=int, default=100000, help="合成向量条数")
+parser.add_argument("--dim", type=int, default=1536, help="合成向量维度（text-embedding-v2 为 1536）")
+parser.add_argument("--clusters", type=int, default=200, help="合成向量的聚类数")
+parser.add_argument("--source-dir", help="读取该 Chroma 目录中的真实向量代替合成数据")
+parser.add_argument("--collection", default="rag_collection", help="--source-dir 中的 collection 名")
+parser.add_argument("--queries", type=int, default=200)
+parser.add_argument("--k", type=int, default=10)
+parser.add_argument("--grid", action="append", default=[], metavar="KEY=V1,V2",
+                    help="待比较的 HNSW 参数：space / m / construction_ef / search_ef / batch_size / sync_threshold")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--json-out", help="把结果写入 JSON 文件")
+args = parser.parse_args()
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import chromadb
+
+from core.hnsw_index import copy_collection, hnsw_configuration
+
+_INT_PARAMS = {"m", "construction_ef", "search_ef", "batch_size", "sync_threshold"}
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_vectors(rng: np.random.Generator, count: int) -> np.ndarray:
+    centers = rng.standard_normal((args.clusters, args.dim)).astype(np.float32)
+    labels = rng.integers(0, args.clusters, count)
+    noise = rng.standard_normal((count, args.dim)).astype(np.float32) * 0.6
+    return normalize(centers[labels] + noise)
+
+
+def load_vectors(rng: np.random.Generator):
+    """返回 (库向量, 查询向量)，都已归一化为单位长度"""
+    if not args.source_dir:
+        return synthetic_vectors(rng, args.vectors), synthetic_vectors(rng, args.queries)
+    source = chromadb.PersistentClient(path=args.source_dir).get_collection(args.collection)
+    vectors = []
+
+    class _Collector:  # 借用 copy_collection 的分批读取逻辑
+        def add(self, embeddings, **kwargs):
+            vectors.append(np.asarray(embeddings, dtype=np.float32))
+
+    copy_collection(source, _Collector())
+    vectors = normalize(np.concatenate(vectors))
+    picked = rng.choice(len(vectors), size=min(args.queries, len(vectors) // 10), replace=False)
+    mask = np.ones(len(vectors), dtype=bool)
+    mask[picked] = False
+    return vectors[mask], vectors[picked]
+
+
+def exact_top_k(base: np.ndarray, queries: np.ndarray, k: int) -> list:
+    """单位向量下 l2 / cosine / ip 的排序一致，统一按内积取精确 top-k"""
+    results = []
+    for start in range(0, len(queries), 16):
+        scores = queries[start:start + 16] @ base.T
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        results.extend({str(i) for i in row} for row in top)
+    return results
+
+
+def build_configs() -> list:
+    axes = []
+    for item in args.grid:
+        key, _, raw = item.partition("=")
+        if key not in _INT_PARAMS and key != "space":
+            raise SystemExit(f"未知的 HNSW 参数: {key}")
+        axes.append([(key, int(v) if key in _INT_PARAMS else v) for v in raw.split(",")])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def run_config(client, params: dict, base: np.ndarray, queries: np.ndarray, truth: list) -> dict:
+    configuration = hnsw_configuration(**params)
+    collection = client.create_collection("bench_hnsw", configuration=configuration, embedding_function=None)
+    batch_size = client.get_max_batch_size()
+    start = time.perf_counter()
+    for offset in range(0, len(base), batch_size):
+        end = min(offset + batch_size, len(base))
+        collection.add(ids=[str(i) for i in range(offset, end)], embeddings=base[offset:end])
+    build_seconds = time.perf_counter() - start
+
+    for query in queries[:10]:  # 预热：加载索引
+        collection.query(query_embeddings=[query], n_results=args.k, include=["distances"])
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query], n_results=args.k, include=["distances"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected & set(result["ids"][0])) / args.k)
+    client.delete_collection("bench_hnsw")
+
+    return {
+        "params": configuration["hnsw"],
+        "build_seconds": round(build_seconds, 2),
+        "recall_at_k": round(sum(recalls) / len(recalls), 4),
+        "latency_p50_ms": round(percentile(latencies, 0.5), 3),
+        "latency_p95_ms": round(percentile(latencies, 0.95), 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99), 3),
+    }
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    base, queries = load_vectors(rng)
+    print(f"库向量 {len(base)} 条（{base.shape[1]} 维），查询 {len(queries)} 条，k={args.k}", flush=True)
+    truth = exact_top_k(base, queries, args.k)
+
+    data_dir = tempfile.mkdtemp(prefix="rag_bench_hnsw_")
+    client = chromadb.PersistentClient(path=data_dir)
+    results = []
+    try:
+        for params in build_configs():
+            result = run_config(client, params, base, queries, truth)
+            results.append(result)
+            hnsw = result["params"]
+            print(f"space={hnsw['space']:<6} M={hnsw['max_neighbors']:<3} construction_ef={hnsw['ef_construction']:<4} "
+                  f"search_ef={hnsw['ef_search']:<4} 建索引 {result['build_seconds']:>7.1f}s  "
+                  f"recall@{args.k} {result['recall_at_k']:.4f}  p50 {result['latency_p50_ms']:.2f}ms  "
+                  f"p95 {result['latency_p95_ms']:.2f}ms  p99 {result['latency_p99_ms']:.2f}ms", flush=True)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(base), "dim": int(base.shape[1]), "queries": len(queries), "k": args.k,
+                       "source": args.source_dir or "synthetic", "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+压测：日志关闭 / 同步写日志 / 队列异步写日志 三种模式下的问答延迟（p50/p99）
+
+使用本地假 LLM / 假检索器（见 bench_chain_cache.py），不访问 DashScope，只衡量日志 I/O 带来的开销。
+控制台输出也计入开销，可将 stderr 重定向到文件或 /dev/null 模拟生产环境。
+运行方式（在 RAG_V1 目录下）：
+    python benchmarks/bench_logging.py --requests 2000 --concurrency 50 --level DEBUG 2>/dev/null
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from langchain_core.language_models import FakeListChatModel
+
+from bench_chain_cache import FakeVectorManager
+from core.rag_engine import RAGEngine
+from utils.logger import configure_logging, set_log_level
+
+
+async def run_requests(engine: RAGEngine, mode: str, requests: int, concurrency: int) -> list:
+    """以 concurrency 的并发度发起 requests 个请求，返回每个请求的耗时（毫秒）"""
+    chain = engine.get_chain_with_source()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request(i: int) -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            await chain.ainvoke(
+                {"input": f"问题 {mode}-{i}"},  # 每个问题不同，避免命中答案缓存与请求合并
+                config={"configurable": {"session_id": f"bench-log-{mode}-{i}"}},
+            )
+            return (time.perf_counter() - start) * 1000
+
+    return await asyncio.gather(*(one_request(i) for i in range(requests)))
+
+
+def report(mode: str, latencies: list, wall: float):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{mode:<6} p50={statistics.median(latencies):7.2f}ms  p99={p99:7.2f}ms  "
+          f"qps={len(latencies) / wall * 1000:8.1f}", file=sys.stdout, flush=True)
+
+
+async def main(requests: int, concurrency: int, level: str):
+    engine = RAGEngine(llm=FakeListChatModel(responses=["这是一个测试回答 [1]"]), vector_manager=FakeVectorManager())
+    await run_requests(engine, "warmup", min(requests, 100), concurrency)
+
+    for mode in ("off", "sync", "async"):
+        configure_logging(async_mode=(mode == "async"))
+        set_log_level("WARNING" if mode == "off" else level)
+        start = time.perf_counter()
+        latencies = await run_requests(engine, mode, requests, concurrency)
+        report(mode, latencies, (time.perf_counter() - start) * 1000)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--level", default="INFO", help="sync/async 模式下的日志级别")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.level))
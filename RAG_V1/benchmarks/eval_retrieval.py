@@ -0,0 +1,205 @@
+"""
+检索质量 / 延迟评测：用问题集回放 VectorManager.get_retriever()，按多组配置对比 recall@k、MRR、hit@1 与单次检索延迟，
+用于在追求速度的同时确认答案质量没有悄悄下降。
+
+问题集为 JSONL，每行 {"question": ..., "answer_contains": [...]}：检索到的切片包含任一答案片段即视为相关
+（忽略空白字符），与切片方式无关，因此同一份问题集可以比较不同的 chunk_size / chunk_overlap。
+答案片段应尽量短，过长的片段在小切片下可能跨越切片边界。
+
+--grid 的每个参数对应 Settings 中的一个字段，多个 --grid 取笛卡尔积；--set 对所有配置生效。
+切片 / HNSW 建索引参数不同的配置各自入库到 eval 目录下独立的 Chroma 目录，之后重复评测直接复用。
+运行方式（在 RAG_V1 目录下）：
+    python benchmarks/eval_retrieval.py --grid top_k=2,4,8 --grid retrieval_mode=dense,hybrid
+    python benchmarks/eval_retrieval.py --grid chunk_size=300,800 --grid chunk_overlap=50,150 --json-out eval.json
+    python benchmarks/eval_retrieval.py --grid rerank_enabled=false,true --set rerank_fetch_k=20
+    python benchmarks/eval_retrieval.py --grid hnsw_m=16,32 --grid hnsw_search_ef=20,100
+    python benchmarks/eval_retrieval.py --fake-embeddings --grid top_k=2,4   # 不访问 DashScope，仅验证流程
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent.parent
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--questions", default=str(BENCH_DIR / "eval_questions.jsonl"), help="问题集（JSONL）")
+parser.add_argument("--corpus", nargs="+", default=[str(REPO_ROOT / "data" / "0131.txt")], help="入库的文档")
+parser.add_argument("--eval-dir", default=os.path.join(tempfile.gettempdir(), "rag_eval"),
+                    help="评测用 Chroma 目录的根目录（按切片参数分子目录，可复用）")
+parser.add_argument("--grid", action="append", default=[], metavar="KEY=V1,V2",
+                    help="待比较的配置项，可重复指定")
+parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="所有配置共用的固定配置项")
+parser.add_argument("--repeat", type=int, default=3, help="每个问题计时的次数（取中位数）")
+parser.add_argument("--fake-embeddings", action="store_true", help="使用哈希假向量（质量指标无意义，仅用于冒烟测试）")
+parser.add_argument("--json-out", help="把结果写入 JSON 文件")
+parser.add_argument("--log-level", default="WARNING")
+args = parser.parse_args()
+
+# 必须在导入 core 之前设置，Settings 在导入时读取环境变量；
+# Embedding 缓存建在 eval 根目录下，所有配置共用
+os.environ.update({
+    "CHROMA_PERSIST_DIR": args.eval_dir,
+    "CHROMA_HOST": "",
+    "LOG_LEVEL": args.log_level,
+})
+if args.fake_embeddings:
+    os.environ.update({"DASHSCOPE_API_KEY": "eval", "EMBEDDING_CACHE_ENABLED": "false"})
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+from core.config import Settings, settings
+
+if args.fake_embeddings:
+    from fakes import install_fakes
+    install_fakes()
+
+from core.vector_manager import VectorManager
+from utils.document_processor import DocumentProcessor
+from utils.hash_utils import calculate_file_hash
+
+# 影响入库结果的配置项：取值不同的配置使用各自的 Chroma 目录（hnsw_search_ef 等可在线修改，不在其中）
+INDEX_KEYS = ("chunk_size", "chunk_overlap", "hnsw_space", "hnsw_m", "hnsw_construction_ef")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+def parse_value(key: str, raw: str):
+    """按 Settings 字段的类型转换命令行取值"""
+    field = Settings.model_fields.get(key)
+    if field is None:
+        raise SystemExit(f"未知的配置项: {key}")
+    kind = field.annotation
+    if kind is bool:
+        return raw.strip().lower() in ("1", "true", "yes", "on")
+    if kind in (int, float, str):
+        return kind(raw)
+    if typing.get_origin(kind) is dict:
+        return json.loads(raw)
+    raise SystemExit(f"不支持从命令行设置的配置项: {key}")
+
+
+def build_configs() -> list:
+    fixed = {}
+    for item in args.set:
+        key, _, raw = item.partition("=")
+        fixed[key] = parse_value(key, raw)
+    axes = []
+    for item in args.grid:
+        key, _, raw = item.partition("=")
+        axes.append([(key, parse_value(key, v)) for v in raw.split(",")])
+    # 默认关闭 token 预算组装，让检索器按 top_k 返回，recall@k 的 k 才有意义
+    fixed.setdefault("context_token_budget", 0)
+    return [{**fixed, **dict(combo)} for combo in itertools.product(*axes)]
+
+
+def apply_config(config: dict):
+    for key, value in config.items():
+        setattr(settings, key, value)
+    index_tag = "_".join(f"{key}{getattr(settings, key)}" for key in INDEX_KEYS)
+    settings.chroma_persist_dir = os.path.join(args.eval_dir, index_tag)
+
+
+def load_questions(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def normalize(text: str) -> str:
+    return _WHITESPACE.sub("", text)
+
+
+def ensure_ingested(vector_manager: VectorManager):
+    """把语料入库到当前配置的 Chroma 目录，已入库的文件（按哈希）跳过"""
+    processor = None
+    for path in args.corpus:
+        file_hash = calculate_file_hash(path)
+        if vector_manager.get_file_record(file_hash):
+            continue
+        processor = processor or DocumentProcessor(vector_manager=vector_manager)
+        result = processor.ingest_file(path, os.path.basename(path), file_hash)
+        print(f"  入库 {os.path.basename(path)}: {result['chunks']} 个切片 ({settings.chroma_persist_dir})")
+
+
+def evaluate(config: dict, questions: list) -> dict:
+    apply_config(config)
+    # 检索模式、BM25 索引等在 VectorManager 初始化时确定，因此每组配置都重新创建
+    vector_manager = VectorManager()
+    ensure_ingested(vector_manager)
+    retriever = vector_manager.get_retriever()
+    retriever.invoke(questions[0]["question"])  # 预热：加载重排序模型、建立连接
+
+    recalls, reciprocal_ranks, hits_at_1, latencies, returned = [], [], [], [], []
+    for item in questions:
+        timings = []
+        for _ in range(max(args.repeat, 1)):
+            start = time.perf_counter()
+            docs = retriever.invoke(item["question"])
+            timings.append((time.perf_counter() - start) * 1000)
+        latencies.append(percentile(timings, 0.5))
+        returned.append(len(docs))
+
+        snippets = [normalize(s) for s in item["answer_contains"]]
+        contents = [normalize(doc.page_content) for doc in docs]
+        found = [any(s in c for c in contents) for s in snippets]
+        recalls.append(sum(found) / len(snippets))
+        rank = next((i + 1 for i, c in enumerate(contents) if any(s in c for s in snippets)), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        hits_at_1.append(1.0 if rank == 1 else 0.0)
+
+    vector_manager._search_executor.shutdown(wait=False)
+    count = len(questions)
+    return {
+        "config": config,
+        "chunks": vector_manager.vector_store._collection.count(),
+        "avg_docs": round(sum(returned) / count, 2),
+        "recall_at_k": round(sum(recalls) / count, 4),
+        "mrr": round(sum(reciprocal_ranks) / count, 4),
+        "hit_at_1": round(sum(hits_at_1) / count, 4),
+        "latency_p50_ms": round(percentile(latencies, 0.5), 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95), 2),
+        "latency_mean_ms": round(sum(latencies) / count, 2),
+    }
+
+
+def print_table(results: list):
+    headers = ["配置", "切片数", "平均返回", "recall@k", "MRR", "hit@1", "p50(ms)", "p95(ms)"]
+    rows = [[", ".join(f"{k}={v}" for k, v in r["config"].items()), r["chunks"], r["avg_docs"],
+             f"{r['recall_at_k']:.3f}", f"{r['mrr']:.3f}", f"{r['hit_at_1']:.3f}",
+             f"{r['latency_p50_ms']:.1f}", f"{r['latency_p95_ms']:.1f}"] for r in results]
+    widths = [max(len(str(row[i])) for row in rows + [headers]) for i in range(len(headers))]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(row, widths)))
+
+
+def main():
+    questions = load_questions(args.questions)
+    configs = build_configs()
+    print(f"问题数 {len(questions)}，配置数 {len(configs)}，语料 {len(args.corpus)} 个文件")
+    results = []
+    for config in configs:
+        print(f"评测: {config}", flush=True)
+        results.append(evaluate(config, questions))
+    print()
+    print_table(results)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"questions": len(questions), "fake_embeddings": args.fake_embeddings, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
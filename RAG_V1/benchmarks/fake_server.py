@@ -0,0 +1,51 @@
+"""
+离线压测服务：用本地假 LLM / 假 Embedding 启动完整的 RAG API（main.app），不访问 DashScope。
+启动前按需向 collection 写入指定数量的合成切片。一般由 load_test.py 拉起，也可单独运行：
+    python benchmarks/fake_server.py --port 8010 --data-dir /tmp/rag_bench/10000 --chunks 10000
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--port", type=int, default=8010)
+parser.add_argument("--data-dir", required=True, help="Chroma 持久化目录（压测数据可复用）")
+parser.add_argument("--chunks", type=int, default=10000, help="知识库切片数")
+parser.add_argument("--chunk-chars", type=int, default=300)
+parser.add_argument("--dim", type=int, default=256, help="假向量维度")
+parser.add_argument("--first-token-ms", type=float, default=300.0)
+parser.add_argument("--token-ms", type=float, default=20.0)
+parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+parser.add_argument("--log-level", default="WARNING")
+args = parser.parse_args()
+
+# 必须在导入 core 之前设置，Settings 在导入时读取环境变量
+os.environ.update({
+    "DASHSCOPE_API_KEY": "bench",
+    "CHROMA_PERSIST_DIR": args.data_dir,
+    "CHROMA_HOST": "",
+    "EMBEDDING_CACHE_ENABLED": "false",
+    "LOG_LEVEL": args.log_level,
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import uvicorn
+
+from core.config import settings
+from fakes import install_fakes, seed_collection
+
+install_fakes(dim=args.dim, embed_latency_ms=args.embed_latency_ms,
+              first_token_ms=args.first_token_ms, token_ms=args.token_ms)
+
+from core.vector_manager import VectorManager
+
+# 造数用的临时 VectorManager 不需要 BM25 索引，服务启动时会基于完整数据重新构建
+mode, settings.retrieval_mode = settings.retrieval_mode, "dense"
+seed_collection(VectorManager(), args.chunks, chunk_chars=args.chunk_chars)
+settings.retrieval_mode = mode
+
+import main
+
+uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
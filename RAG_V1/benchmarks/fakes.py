@@ -0,0 +1,154 @@
+"""
+离线压测用的本地替身：固定延迟的流式假 LLM、基于哈希的确定性假 Embedding，以及合成知识库数据。
+install_fakes() 直接写入 ModelFactory 的进程内单例，之后所有组件拿到的都是假实现，不访问网络。
+"""
+import asyncio
+import hashlib
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# 合成文本使用的词表：足够多样，让 BM25 与向量检索都有区分度
+VOCABULARY = [
+    "报销", "流程", "审批", "合同", "采购", "预算", "发票", "差旅", "住宿", "标准", "权限", "系统", "账号",
+    "密码", "重置", "网络", "服务器", "部署", "备份", "恢复", "监控", "告警", "日志", "数据库", "接口",
+    "版本", "发布", "测试", "安全", "审计", "培训", "考勤", "请假", "加班", "薪资", "福利", "保险", "入职",
+    "离职", "转正", "绩效", "目标", "会议", "纪要", "客户", "订单", "库存", "物流", "退货", "售后", "质量",
+    "规范", "模板", "文档", "知识库", "检索", "模型", "向量", "索引", "配置", "参数", "阈值", "延迟", "吞吐",
+]
+
+
+def synthetic_text(rng: random.Random, chars: int) -> str:
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(VOCABULARY) if rng.random() > 0.1 else f"E-{rng.randint(100, 9999)}"
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def synthetic_question(rng: random.Random) -> str:
+    return "".join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 6))) + "怎么处理？"
+
+
+class HashEmbeddings(Embeddings):
+    """基于文本哈希的确定性向量（单位长度），同一文本总是得到同一向量；可选模拟接口延迟"""
+
+    def __init__(self, dim: int = 256, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self._vector(text)
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """固定延迟的流式假 LLM：first_token_ms 后吐出首个 token，之后每 token_ms 吐出一个"""
+
+    response: str = "根据参考内容，该问题的处理方式如下：先提交申请，再由负责人审批，最后归档备查 [1]。"
+    first_token_ms: float = 300.0
+    token_ms: float = 20.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _usage(self, messages: List[BaseMessage]) -> dict:
+        prompt = sum(len(str(m.content)) for m in messages)
+        return {"input_tokens": prompt, "output_tokens": len(self.response),
+                "total_tokens": prompt + len(self.response)}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep((self.first_token_ms + self.token_ms * (len(self.response) - 1)) / 1000)
+        message = AIMessage(content=self.response, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for i, token in enumerate(self.response):
+            time.sleep((self.first_token_ms if i == 0 else self.token_ms) / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages)))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for i, token in enumerate(self.response):
+            await asyncio.sleep((self.first_token_ms if i == 0 else self.token_ms) / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages)))
+
+
+def install_fakes(dim: int = 256, embed_latency_ms: float = 0.0, first_token_ms: float = 300.0,
+                  token_ms: float = 20.0):
+    """把 ModelFactory 的 LLM / Embedding 单例替换为本地假实现（需在创建任何组件之前调用）"""
+    from core.model_factory import ModelFactory
+
+    embeddings = HashEmbeddings(dim=dim, latency_ms=embed_latency_ms)
+    ModelFactory._llm = FakeStreamingChatModel(first_token_ms=first_token_ms, token_ms=token_ms)
+    ModelFactory._embedding = embeddings
+    return embeddings
+
+
+def seed_collection(vector_manager, chunks: int, chunk_chars: int = 300, chunks_per_file: int = 100,
+                    batch_size: int = 5000, seed: int = 42):
+    """
+    向 vector_manager 的 collection 写入 chunks 个合成切片（直接写入向量，不经过入库流程）。
+    collection 中已有不少于 chunks 个切片时跳过，便于多次压测复用同一份数据。
+    """
+    collection = vector_manager.vector_store._collection
+    existing = collection.count()
+    if existing >= chunks:
+        print(f"collection 已有 {existing} 个切片，跳过造数")
+        return
+    rng = random.Random(seed)
+    embeddings = vector_manager.embeddings
+    start = time.perf_counter()
+    for offset in range(existing, chunks, batch_size):
+        ids, texts, metadatas = [], [], []
+        for i in range(offset, min(offset + batch_size, chunks)):
+            file_no = i // chunks_per_file
+            ids.append(f"seed-{i}")
+            texts.append(synthetic_text(rng, chunk_chars))
+            metadatas.append({"file_name": f"seed_{file_no}.txt", "file_hash": f"seed-{file_no}",
+                              "start_index": (i % chunks_per_file) * chunk_chars})
+        collection.upsert(ids=ids, embeddings=embeddings.embed_documents(texts), documents=texts, metadatas=metadatas)
+        done = min(offset + batch_size, chunks)
+        print(f"已写入 {done}/{chunks} 个切片 ({done / (time.perf_counter() - start):.0f} chunks/s)", flush=True)
@@ -0,0 +1,253 @@
+"""
+离线 RAG 压测：拉起 fake_server.py（本地假 LLM / 假 Embedding + 合成知识库），
+并发压测 /chat、/chat/v2、/chat/v2/stream 与 /upload，输出 QPS、p50/p95/p99、各阶段耗时分位数与峰值 RSS。
+不访问网络，可在笔记本或 CI 中运行。
+运行方式（在 RAG_V1 目录下）：
+    python benchmarks/load_test.py --chunks 10000 --requests 500 --concurrency 50
+    python benchmarks/load_test.py --chunks 1000000 --scenarios chat_v2 --json-out result.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fakes import synthetic_question, synthetic_text
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = Path(__file__).resolve().parent
+_BUCKET_LINE = re.compile(r'^rag_stage_seconds_bucket\{stage="([^"]+)",le="([^"]+)"\} (\S+)$')
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+# --- 服务端阶段耗时：抓取 /metrics 中的直方图，按场景前后做差再估算分位数 ---
+
+def scrape_stage_buckets(client: httpx.Client) -> dict:
+    """返回 {stage: {上界: 累积计数}}"""
+    buckets = {}
+    for line in client.get("/metrics").text.splitlines():
+        match = _BUCKET_LINE.match(line)
+        if match:
+            stage, le, count = match.groups()
+            buckets.setdefault(stage, {})[float(le)] = float(count)
+    return buckets
+
+
+def diff_buckets(after: dict, before: dict) -> dict:
+    return {stage: {le: count - before.get(stage, {}).get(le, 0) for le, count in series.items()}
+            for stage, series in after.items()}
+
+
+def histogram_quantile(series: dict, q: float) -> float:
+    """与 Prometheus histogram_quantile 相同：在命中的分桶内线性插值（毫秒）"""
+    bounds = sorted(series)
+    total = series[bounds[-1]]
+    if total <= 0:
+        return 0.0
+    rank, prev_bound, prev_count = q * total, 0.0, 0.0
+    for bound in bounds:
+        count = series[bound]
+        if count >= rank:
+            if bound == float("inf"):
+                return prev_bound * 1000
+            return (prev_bound + (bound - prev_bound) * (rank - prev_count) / max(count - prev_count, 1e-9)) * 1000
+        prev_bound, prev_count = bound, count
+    return prev_bound * 1000
+
+
+# --- 压测场景：每个函数发起一次请求，返回 (延迟毫秒, 首 token 毫秒或 None) ---
+
+async def chat_once(client: httpx.AsyncClient, path: str, query: str, session_id: str):
+    start = time.perf_counter()
+    response = await client.post(path, json={"query": query, "session_id": session_id})
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000, None
+
+
+async def stream_once(client: httpx.AsyncClient, query: str, session_id: str):
+    start, first_token = time.perf_counter(), None
+    async with client.stream("POST", "/chat/v2/stream", json={"query": query, "session_id": session_id}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line == "event: token":
+                first_token = (time.perf_counter() - start) * 1000
+            if line.startswith("event: error"):
+                raise RuntimeError("流式接口返回 error 事件")
+    return (time.perf_counter() - start) * 1000, first_token
+
+
+async def upload_once(client: httpx.AsyncClient, content: str, name: str):
+    """上传并轮询任务直到完成，延迟为端到端入库耗时"""
+    start = time.perf_counter()
+    response = await client.post("/upload", files={"file": (name, content.encode("utf-8"), "text/plain")})
+    response.raise_for_status()
+    job_id = response.json().get("job_id")
+    while job_id:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] == "success":
+            break
+        if job["status"] in ("failed", "interrupted"):
+            raise RuntimeError(f"入库任务失败: {job.get('error')}")
+        await asyncio.sleep(0.05)
+    return (time.perf_counter() - start) * 1000, None
+
+
+async def run_scenario(base_url: str, name: str, requests: int, concurrency: int, sessions: int,
+                       repeat_ratio: float, rng: random.Random) -> dict:
+    questions = [synthetic_question(rng) for _ in range(requests)]
+    # 按比例复用已出现过的问题，模拟热点问题（命中答案缓存 / 请求合并）
+    for i in range(1, requests):
+        if rng.random() < repeat_ratio:
+            questions[i] = questions[rng.randrange(i)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_tokens, errors = [], [], 0
+
+    async def one(i: int, client: httpx.AsyncClient):
+        nonlocal errors
+        session_id = f"load-{name}-{i % sessions}"
+        async with semaphore:
+            try:
+                if name == "chat":
+                    result = await chat_once(client, "/chat", questions[i], session_id)
+                elif name == "chat_v2":
+                    result = await chat_once(client, "/chat/v2", questions[i], session_id)
+                elif name == "stream":
+                    result = await stream_once(client, questions[i], session_id)
+                else:
+                    result = await upload_once(client, synthetic_text(random.Random(i), 20000), f"load_{i}.txt")
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"[{name}] 请求失败: {e!r}", file=sys.stderr)
+                return
+        latencies.append(result[0])
+        if result[1] is not None:
+            first_tokens.append(result[1])
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i, client) for i in range(requests)))
+        wall = time.perf_counter() - start
+
+    result = {"requests": requests, "errors": errors, "qps": round(len(latencies) / wall, 1),
+              **{f"p{int(q * 100)}_ms": round(percentile(latencies, q), 1) for q in (0.5, 0.95, 0.99)}}
+    if first_tokens:
+        result["first_token_p50_ms"] = round(percentile(first_tokens, 0.5), 1)
+        result["first_token_p99_ms"] = round(percentile(first_tokens, 0.99), 1)
+    return result
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"压测服务启动失败，退出码 {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("等待压测服务启动超时")
+
+
+def peak_rss_mb(who) -> float:
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(rss / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def print_report(report: dict):
+    print(f"\n知识库切片数: {report['config']['chunks']}, 并发: {report['config']['concurrency']}")
+    for name, result in report["scenarios"].items():
+        line = (f"{name:<8} requests={result['requests']:<6} errors={result['errors']:<4} qps={result['qps']:<8} "
+                f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms")
+        if "first_token_p50_ms" in result:
+            line += f" 首token p50={result['first_token_p50_ms']}ms p99={result['first_token_p99_ms']}ms"
+        print(line)
+        for stage, quantiles in sorted(result.get("stages", {}).items()):
+            print(f"    {stage:<15} p50={quantiles['p50_ms']:8.1f}ms  p95={quantiles['p95_ms']:8.1f}ms  "
+                  f"p99={quantiles['p99_ms']:8.1f}ms  n={quantiles['count']}")
+    print(f"峰值 RSS: 服务端 {report['peak_rss_mb']['server']} MB, 压测端 {report['peak_rss_mb']['load_generator']} MB")
+
+
+def main(args):
+    data_dir = args.data_dir or str(Path(tempfile.gettempdir()) / "rag_bench" / f"{args.chunks}_{args.dim}")
+    base_url = f"http://127.0.0.1:{args.port}"
+    command = [
+        sys.executable, str(BENCH_DIR / "fake_server.py"), "--port", str(args.port), "--data-dir", data_dir,
+        "--chunks", str(args.chunks), "--dim", str(args.dim), "--first-token-ms", str(args.first_token_ms),
+        "--token-ms", str(args.token_ms), "--embed-latency-ms", str(args.embed_latency_ms),
+    ]
+    process = subprocess.Popen(command, cwd=BENCH_DIR.parent)
+    rng = random.Random(args.seed)
+    report = {"config": vars(args), "scenarios": {}}
+    try:
+        wait_ready(base_url, process, args.startup_timeout)
+        with httpx.Client(base_url=base_url, timeout=30) as client:
+            for name in args.scenarios.split(","):
+                requests = args.upload_requests if name == "upload" else args.requests
+                before = scrape_stage_buckets(client)
+                result = asyncio.run(run_scenario(base_url, name, requests, args.concurrency, args.sessions,
+                                                  args.repeat_ratio, rng))
+                stages = diff_buckets(scrape_stage_buckets(client), before)
+                result["stages"] = {
+                    stage: {"count": int(series[float("inf")]),
+                            **{f"p{int(q * 100)}_ms": round(histogram_quantile(series, q), 1) for q in (0.5, 0.95, 0.99)}}
+                    for stage, series in stages.items() if series.get(float("inf"), 0) > 0
+                }
+                report["scenarios"][name] = result
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    report["peak_rss_mb"] = {"server": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+                             "load_generator": peak_rss_mb(resource.RUSAGE_SELF) if resource else None}
+    print_report(report)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=10000, help="知识库切片数（10k ~ 1M）")
+    parser.add_argument("--dim", type=int, default=256, help="假向量维度")
+    parser.add_argument("--data-dir", help="Chroma 数据目录，默认放在系统临时目录下并按切片数复用")
+    parser.add_argument("--scenarios", default="chat,chat_v2,stream,upload", help="逗号分隔: chat,chat_v2,stream,upload")
+    parser.add_argument("--requests", type=int, default=500, help="每个问答场景的请求数")
+    parser.add_argument("--upload-requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=100, help="会话数（同一会话的后续请求会带历史）")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="重复问题的比例")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--startup-timeout", type=float, default=3600, help="含造数时间")
+    parser.add_argument("--json-out", help="将结果写入 JSON 文件（便于 CI 对比）")
+    main(parser.parse_args())
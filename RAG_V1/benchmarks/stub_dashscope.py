@@ -0,0 +1,91 @@
+"""
+DashScope 本地桩服务：模拟 OpenAI 兼容的 chat/completions（含流式）与 text-embedding 接口，
+并统计请求数与客户端连接数，用于离线验证连接复用。
+运行方式（在 RAG_V1 目录下）：
+    python benchmarks/stub_dashscope.py --port 8765
+然后在 .env 中设置：
+    LLM_BASE_URL=http://127.0.0.1:8765/compatible-mode/v1
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8765/api/v1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="DashScope Stub")
+_stats = {"requests": 0, "connections": set()}
+EMBEDDING_DIM = 64
+REPLY = "这是桩服务返回的测试回答 [1]"
+
+
+def _track(request: Request):
+    _stats["requests"] += 1
+    # 同一条 TCP 连接的客户端端口不变，不同端口数即为建立过的连接数
+    _stats["connections"].add((request.client.host, request.client.port))
+
+
+def fake_vector(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """基于哈希的确定性向量，同一文本总是得到同一向量"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(dim)]
+
+
+@app.post("/api/v1/services/embeddings/text-embedding/text-embedding")
+async def embeddings(request: Request):
+    _track(request)
+    body = await request.json()
+    texts = body["input"]["texts"]
+    return {"output": {"embeddings": [{"text_index": i, "embedding": fake_vector(t)} for i, t in enumerate(texts)]},
+            "usage": {"total_tokens": sum(len(t) for t in texts)}}
+
+
+@app.post("/compatible-mode/v1/chat/completions")
+async def chat_completions(request: Request):
+    _track(request)
+    body = await request.json()
+    model, created = body.get("model", "stub"), int(time.time())
+    if not body.get("stream"):
+        return {"id": "stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": len(REPLY), "total_tokens": 10 + len(REPLY)}}
+
+    async def stream():
+        for ch in REPLY:
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": ch}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(0)
+        done = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": len(REPLY), "total_tokens": 10 + len(REPLY)}}
+        yield f"data: {json.dumps(done, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    return {"requests": _stats["requests"], "connections": len(_stats["connections"])}
+
+
+def run_in_thread(port: int) -> uvicorn.Server:
+    """在后台线程中启动桩服务，返回 server（设置 server.should_exit = True 即可停止）"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
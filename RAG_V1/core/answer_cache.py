@@ -0,0 +1,273 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("AnswerCache")
+
+_TRAILING_PUNCT = re.compile(r"[\s\?？。\.!！~～]+$")
+_WHITESPACE = re.compile(r"\s+")
+# 分区整体清理过期条目的最小间隔（秒）
+_PURGE_INTERVAL_SECONDS = 60
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本：去首尾空白、统一大小写、合并空白、去掉结尾标点"""
+    question = _WHITESPACE.sub(" ", question.strip().lower())
+    return _TRAILING_PUNCT.sub("", question)
+
+
+def history_fingerprint(messages) -> str:
+    """
+    会话历史的摘要：回答 Prompt 中包含 chat_history，同一独立问题在不同历史下的回答并不相同，
+    合并请求与缓存答案时需要把它加入键中。无历史时返回空字符串
+    """
+    if not messages:
+        return ""
+    payload = json.dumps([(m.type, m.content) for m in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _CacheEntry:
+    __slots__ = ("question", "history", "value", "created_at", "slot")
+
+    def __init__(self, question: str, history: str, value, created_at: float):
+        self.question = question
+        self.history = history
+        self.value = value
+        self.created_at = created_at
+        self.slot = None  # 问题向量在分区矩阵中的行号，无向量时为 None
+
+
+class _Partition:
+    """
+    一个 (collection, variant) 分区：LRU 有序字典 + 按行存放问题向量的矩阵。
+    矩阵按需倍增到 capacity 行后不再重新分配，条目淘汰后行号复用；
+    语义匹配直接在矩阵上做一次矩阵向量乘，历史摘要与过期时间用向量化掩码过滤（调用方持锁）
+    """
+
+    _INITIAL_ROWS = 64
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = OrderedDict()  # (history, normalized_question) -> _CacheEntry
+        self.matrix = None  # (rows, dim)，首次写入向量时按维度分配
+        self.created = np.empty(0)  # 每行条目的写入时间，空行为 -inf
+        self.histories = np.empty(0, dtype=np.int64)  # 每行条目的历史摘要哈希
+        self.keys = []  # 每行对应的条目键
+        self.free = []
+        self.last_purge = time.time()
+
+    def _grow(self, dim: int):
+        rows = len(self.keys)
+        new_rows = min(max(rows * 2, self._INITIAL_ROWS), self.capacity)
+        matrix = np.zeros((new_rows, dim), dtype=np.float32)
+        if self.matrix is not None:
+            matrix[:rows] = self.matrix
+        self.matrix = matrix
+        self.created = np.concatenate([self.created, np.full(new_rows - rows, -np.inf)])
+        self.histories = np.concatenate([self.histories, np.zeros(new_rows - rows, dtype=np.int64)])
+        self.keys.extend([None] * (new_rows - rows))
+        self.free.extend(range(new_rows - 1, rows - 1, -1))
+
+    def remove(self, key: tuple):
+        entry = self.entries.pop(key)
+        if entry.slot is not None:
+            self.created[entry.slot] = -np.inf
+            self.keys[entry.slot] = None
+            self.free.append(entry.slot)
+
+    def insert(self, key: tuple, entry: _CacheEntry, vector) -> int:
+        """写入条目，超过容量时先淘汰最久未使用的条目，返回淘汰数"""
+        if self.capacity <= 0:
+            return 0
+        if key in self.entries:
+            self.remove(key)
+        evicted = 0
+        while self.entries and len(self.entries) >= self.capacity:
+            self.remove(next(iter(self.entries)))
+            evicted += 1
+        if vector is not None and (self.matrix is None or self.matrix.shape[1] == len(vector)):
+            if not self.free:
+                self._grow(len(vector))
+            slot = self.free.pop()
+            self.matrix[slot] = vector
+            self.created[slot] = entry.created_at
+            self.histories[slot] = hash(entry.history)
+            self.keys[slot] = key
+            entry.slot = slot
+        self.entries[key] = entry
+        return evicted
+
+    def purge(self, cutoff: float) -> int:
+        """删除 cutoff 之前写入的过期条目，返回删除数"""
+        expired = [k for k, e in self.entries.items() if e.created_at < cutoff]
+        for k in expired:
+            self.remove(k)
+        return len(expired)
+
+    def best_match(self, vector, history: str, cutoff: float):
+        """在相同历史、未过期的条目中找与 vector 最相似的一个，返回 (键, 相似度)，没有候选返回 None"""
+        if self.matrix is None or len(self.entries) == 0:
+            return None
+        valid = (self.created >= cutoff) & (self.histories == hash(history))
+        if not valid.any():
+            return None
+        scores = np.where(valid, self.matrix @ vector, -np.inf)
+        best = int(np.argmax(scores))
+        key = self.keys[best]
+        if key is None or self.entries[key].history != history:  # 哈希碰撞
+            return None
+        return key, float(scores[best])
+
+
+class CacheLookup(NamedTuple):
+    """一次查找的结果：value 为命中值（未命中为 None）；未命中时 vector 与 generation 交给 put 使用"""
+    value: Any
+    vector: Any
+    generation: int
+
+
+class AnswerCache:
+    """
+    语义答案缓存：以 (会话历史摘要, 独立问题) 为键，先精确匹配，再在相同历史的条目中按向量余弦相似度匹配。
+    每个 (collection, variant) 一个 LRU 分区，条目超过 TTL 自动失效；
+    知识库变更时按 collection 整体失效，失效前开始生成的答案不会再写回。
+    """
+
+    def __init__(self, embeddings=None, max_size: int = 1000, ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.95):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._partitions = {}  # (collection, variant) -> _Partition
+        self._generations = {}  # collection -> 失效次数，用于丢弃失效前开始生成的答案
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0,
+                       "stale_puts": 0}
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.embeddings is not None and self.similarity_threshold < 1.0
+
+    # 向量化使用原始独立问题（与检索器的查询文本一致），Embedding 的查询缓存可直接命中，避免重复调用接口
+    def _embed(self, question: str):
+        return _normalize(self.embeddings.embed_query(question))
+
+    async def _aembed(self, question: str):
+        return _normalize(await self.embeddings.aembed_query(question))
+
+    def _partition(self, collection: str, variant: str, now: float) -> _Partition:
+        """
+        取分区（不存在则创建）；过期条目在读取时按条目判断，
+        整体清理最多每 _PURGE_INTERVAL_SECONDS 秒一次，不在每次查找时遍历分区（调用方持锁）
+        """
+        partition = self._partitions.get((collection, variant))
+        if partition is None:
+            partition = self._partitions[(collection, variant)] = _Partition(self.max_size)
+        elif now - partition.last_purge > _PURGE_INTERVAL_SECONDS:
+            partition.last_purge = now
+            self._stats["evictions"] += partition.purge(now - self.ttl_seconds)
+        return partition
+
+    def get(self, collection: str, variant: str, question: str, history: str = "") -> CacheLookup:
+        """查找缓存；history 为 history_fingerprint(chat_history)"""
+        key = (history, normalize_question(question))
+        hit, generation = self._exact_lookup(collection, variant, key)
+        if hit is not None or not self.semantic_enabled:
+            return CacheLookup(hit, None, generation)
+        # 向量计算放在锁外，避免阻塞其他请求；未命中时 put 直接复用这个向量
+        vector = self._embed(question)
+        return self._semantic_lookup(collection, variant, question, history, vector, generation)
+
+    async def aget(self, collection: str, variant: str, question: str, history: str = "") -> CacheLookup:
+        """get 的异步版本：语义匹配时异步计算问题向量"""
+        key = (history, normalize_question(question))
+        hit, generation = self._exact_lookup(collection, variant, key)
+        if hit is not None or not self.semantic_enabled:
+            return CacheLookup(hit, None, generation)
+        vector = await self._aembed(question)
+        return self._semantic_lookup(collection, variant, question, history, vector, generation)
+
+    def _exact_lookup(self, collection: str, variant: str, key: tuple):
+        """精确匹配：返回 (命中值, 当前失效代数)"""
+        now = time.time()
+        with self._lock:
+            generation = self._generations.get(collection, 0)
+            partition = self._partition(collection, variant, now)
+            entry = partition.entries.get(key)
+            if entry is not None and now - entry.created_at > self.ttl_seconds:
+                partition.remove(key)
+                self._stats["evictions"] += 1
+                entry = None
+            if entry is not None:
+                partition.entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return entry.value, generation
+            if not self.semantic_enabled:
+                self._stats["misses"] += 1
+        return None, generation
+
+    def _semantic_lookup(self, collection: str, variant: str, question: str, history: str, query_vector,
+                         generation: int) -> CacheLookup:
+        now = time.time()
+        with self._lock:
+            partition = self._partitions.get((collection, variant))
+            match = partition.best_match(query_vector, history, now - self.ttl_seconds) if partition else None
+            if match is not None and match[1] >= self.similarity_threshold:
+                best_key, score = match
+                entry = partition.entries[best_key]
+                partition.entries.move_to_end(best_key)
+                self._stats["semantic_hits"] += 1
+                logger.info(f"语义缓存命中: '{question}' ≈ '{entry.question}' (相似度 {score:.3f})")
+                return CacheLookup(entry.value, query_vector, generation)
+            self._stats["misses"] += 1
+        return CacheLookup(None, query_vector, generation)
+
+    def put(self, collection: str, variant: str, question: str, value, history: str = "",
+            lookup: Optional[CacheLookup] = None):
+        """
+        写入缓存，超过容量时淘汰最久未使用的条目。
+        lookup 为本次生成前的查找结果：复用其中的问题向量；查找之后知识库已变更（缓存已失效）时放弃写入
+        """
+        if lookup is not None and lookup.vector is not None:
+            vector = lookup.vector
+        else:
+            vector = self._embed(question) if self.semantic_enabled else None
+        key = (history, normalize_question(question))
+        with self._lock:
+            if lookup is not None and lookup.generation != self._generations.get(collection, 0):
+                self._stats["stale_puts"] += 1
+                return
+            now = time.time()
+            partition = self._partition(collection, variant, now)
+            self._stats["evictions"] += partition.insert(key, _CacheEntry(question, history, value, now), vector)
+
+    def invalidate(self, collection: str):
+        """知识库变更时清空该 collection 下的所有缓存"""
+        with self._lock:
+            for part_key in [k for k in self._partitions if k[0] == collection]:
+                del self._partitions[part_key]
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+            self._stats["invalidations"] += 1
+        logger.info(f"知识库 {collection} 已变更，答案缓存已失效")
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = sum(len(p.entries) for p in self._partitions.values())
+            return {**self._stats, "size": size}
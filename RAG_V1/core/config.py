@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
+from typing import Dict
 
 class Settings(BaseSettings):
     # 自动映射环境变量 DASHSCOPE_API_KEY，若不存在则报错
@@ -11,11 +12,129 @@ class Settings(BaseSettings):
     
     chroma_persist_dir: str = "./ragv1/data/chroma_db"
     collection_name: str = "rag_collection"
+    # 多 worker 部署时设置 Chroma Server 地址；为空则使用本地持久化目录（仅限单进程写入）
+    # 端口默认 8001，避免与 API 服务的 8000 冲突
+    chroma_host: str = ""
+    chroma_port: int = 8001
+    # 多 worker 之间同步知识库版本的检查间隔（秒）
+    corpus_sync_interval_seconds: float = 1.0
+
+    # API 服务的 worker 进程数（python main.py 启动时生效）
+    api_workers: int = 1
+    
+    # LLM 接入方式：compatible=DashScope OpenAI 兼容接口（共享连接池）；tongyi=官方 SDK（每次新建连接）
+    llm_api: str = "compatible"
+    llm_base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    dashscope_base_url: str = "https://dashscope.aliyuncs.com/api/v1"
+
+    # HTTP 连接池：chat 与 embedding 流量各一个池，长连接复用，h2 已安装时启用 HTTP/2
+    # 两个 base_url 可指向本地桩服务（benchmarks/stub_dashscope.py）做离线验证
+    llm_http_pool_size: int = 100
+    llm_timeout_seconds: float = 60.0
+    embedding_http_pool_size: int = 100
+    embedding_http_timeout_seconds: float = 10.0
+    http_connect_timeout_seconds: float = 5.0
+    http_keepalive_seconds: float = 60.0
+    http2_enabled: bool = True
+
+    # 客户端限流（每个进程独立计数，多 worker 部署时按 worker 数分摊服务商配额）：
+    # RPM/TPM 令牌桶 + AIMD 自适应并发，排队超过 limiter_queue_timeout_seconds 的请求直接丢弃（返回 503），
+    # 重试次数不超过正常请求的 retry_budget_ratio 倍
+    limiter_enabled: bool = True
+    llm_rpm: int = 600
+    llm_tpm: int = 1000000
+    llm_max_concurrency: int = 64
+    # 估算 TPM 时为每次 LLM 调用预留的输出 token 数
+    llm_expected_output_tokens: int = 512
+    embedding_rpm: int = 1800
+    embedding_tpm: int = 1200000
+    embedding_max_concurrency: int = 32
+    limiter_min_concurrency: int = 1
+    limiter_queue_timeout_seconds: float = 10.0
+    limiter_max_retries: int = 3
+    retry_budget_ratio: float = 0.1
+
+    # 本地 Chroma 检索的独立线程池大小（异步问答链使用）
+    vector_search_threads: int = 8
+
+    # HNSW 向量索引参数（默认值与 Chroma 一致）：
+    # hnsw_space / hnsw_m / hnsw_construction_ef 只在创建 collection 时生效，修改后需执行 python -m utils.rebuild_collection；
+    # hnsw_search_ef 与写入批量 / 落盘阈值在启动时同步到已有 collection
+    hnsw_space: str = "l2"
+    hnsw_m: int = 16
+    hnsw_construction_ef: int = 100
+    hnsw_search_ef: int = 100
+    hnsw_batch_size: int = 100
+    hnsw_sync_threshold: int = 1000
     
     chunk_size: int = 800
     chunk_overlap: int = 150
     top_k: int = 4
 
+    # 检索模式：dense=纯向量检索；hybrid=向量 + BM25 并行召回后倒数排名融合
+    retrieval_mode: str = "hybrid"
+    hybrid_fetch_k: int = 20
+    hybrid_rrf_k: int = 60
+    hybrid_lexical_timeout_ms: float = 50
+
+    # 重排序：先召回 rerank_fetch_k 个候选，本地 CPU 交叉编码器重排后保留 top_k 个
+    rerank_enabled: bool = False
+    rerank_model: str = "BAAI/bge-reranker-base"
+    rerank_fetch_k: int = 50
+    rerank_batch_size: int = 16
+    rerank_timeout_ms: float = 500
+
+    # 上下文组装：检索 context_candidate_k 个候选，合并相邻切片、去重后按 token 预算填充
+    # context_token_budget=0 时关闭，回退为固定 top_k
+    context_token_budget: int = 2000
+    context_candidate_k: int = 10
+    context_dedup_threshold: float = 0.85
+
+    # 会话历史：memory=仅内存；sqlite=内存缓存 + SQLite 追加写持久化（chat_history.db）
+    history_backend: str = "sqlite"
+    history_window: int = 10
+    history_max_sessions: int = 10000
+    history_ttl_seconds: int = 3600
+    history_max_bytes: int = 64 * 1024 * 1024
+
+    # 问题改写：无历史时总是跳过；有历史时，若问题足够长且不含指代词也跳过
+    rewrite_skip_self_contained: bool = True
+    rewrite_min_query_length: int = 6
+
+    # 语义答案缓存：先精确匹配独立问题，再按向量相似度匹配（阈值 >= 1 时仅精确匹配）
+    answer_cache_enabled: bool = True
+    answer_cache_max_size: int = 1000
+    answer_cache_ttl_seconds: int = 3600
+    answer_cache_similarity_threshold: float = 0.95
+
+    # 日志：log_async=True 时业务线程只写内存队列，由后台线程写文件/控制台；log_format 可选 text / json
+    # log_sample_rates 按记录器名采样 INFO 及以下日志，如 LOG_SAMPLE_RATES='{"ContextPacker": 0.1}'
+    log_level: str = "INFO"
+    log_async: bool = True
+    log_format: str = "text"
+    log_sample_rates: Dict[str, float] = {}
+
+    # 调试采样率：按该比例打印完整 Prompt 与链路中间数据（0 表示关闭，链中不插入调试步骤）
+    debug_sample_rate: float = 0.0
+
+    # 请求合并：同一 worker 内独立问题（归一化后）、会话历史与知识库版本都相同的并发请求，只执行一次检索与生成
+    coalesce_enabled: bool = True
+
+    # Embedding 持久化缓存（与 file_registry.db 同目录的 embedding_cache.db）
+    embedding_cache_enabled: bool = True
+
+    # 入库向量化：单次请求条数（DashScope text-embedding-v2 上限 25）、并发数与退避重试
+    embedding_batch_size: int = 25
+    embedding_concurrency: int = 4
+    # 重试参数仅在 LIMITER_ENABLED=false 时生效，启用限流器时由传输层按重试预算重试
+    embedding_max_retries: int = 5
+    embedding_backoff_base: float = 1.0
+
+    # 后台入库任务的最大并发数
+    max_ingest_jobs: int = 2
+    # 流式解析时同时驻留内存的最大页数（PDF 按页惰性加载、按窗口切片入库）
+    ingest_page_window: int = 50
+
     # Pydantic v2 配置
     model_config = SettingsConfigDict(
         env_file=".env", 
@@ -0,0 +1,29 @@
+from core.config import settings
+from core.ingest_jobs import IngestJobManager
+from core.rag_engine import RAGEngine
+from core.vector_manager import VectorManager
+from utils.document_processor import DocumentProcessor
+from utils.logger import setup_logger
+
+
+logger = setup_logger("Container")
+
+
+class AppContainer:
+    """
+    进程级组件容器：每个 worker 进程只创建一套组件，所有组件共用同一个 VectorManager
+    （同一个 Chroma 客户端、BM25 索引与 Embedding 缓存）。由 FastAPI lifespan 负责创建与关闭。
+    跨进程共享的状态（文件账本、知识库版本、会话历史、入库任务）都放在 SQLite / Chroma 中。
+    """
+
+    def __init__(self):
+        self.vector_manager = VectorManager()
+        self.rag_engine = RAGEngine(vector_manager=self.vector_manager)
+        self.doc_processor = DocumentProcessor(vector_manager=self.vector_manager)
+        # 后台入库任务队列，最大并发任务数（每个 worker）可通过 MAX_INGEST_JOBS 配置
+        self.ingest_jobs = IngestJobManager(self.doc_processor, self.vector_manager.db_path, settings.max_ingest_jobs)
+        logger.info("业务组件初始化完成")
+
+    def close(self):
+        self.ingest_jobs.shutdown()
+        logger.info("业务组件已关闭")
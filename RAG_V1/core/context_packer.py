@@ -0,0 +1,99 @@
+import math
+import re
+from typing import List
+
+from langchain_core.documents import Document
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("ContextPacker")
+
+_CJK_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩文字约 1 字 1 token，其余字符约 4 字符 1 token"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    text = re.sub(r"\s+", "", text)
+    return {text[i : i + n] for i in range(max(len(text) - n + 1, 1))}
+
+
+class ContextPacker:
+    """
+    按 token 预算组装上下文，替代固定 top_k：
+    1. 合并同一文件（同一页）中相邻/重叠的切片（依据切片器写入的 start_index）
+    2. 去掉近似重复的切片
+    3. 按检索排名贪心填充，直到用完 token 预算
+    """
+
+    def __init__(self, token_budget: int, dedup_threshold: float = 0.85):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+
+    def _merge_adjacent(self, docs: List[Document]) -> List[Document]:
+        """合并重叠切片，合并后的排名取其中最靠前的一个"""
+        groups = {}
+        for rank, doc in enumerate(docs):
+            meta = doc.metadata
+            if "start_index" not in meta:
+                groups[("__single__", rank)] = [(rank, doc)]
+                continue
+            key = (meta.get("file_hash") or meta.get("file_name"), meta.get("page"))
+            groups.setdefault(key, []).append((rank, doc))
+
+        merged = []
+        for items in groups.values():
+            items.sort(key=lambda item: item[1].metadata.get("start_index", 0))
+            cur_rank, cur = items[0]
+            cur_start = cur.metadata.get("start_index", 0)
+            cur_text = cur.page_content
+            for rank, doc in items[1:]:
+                start = doc.metadata["start_index"]
+                cur_end = cur_start + len(cur_text)
+                if start <= cur_end:
+                    # 重叠或紧邻：只拼接未覆盖的部分
+                    cur_text += doc.page_content[cur_end - start :]
+                    cur_rank = min(cur_rank, rank)
+                else:
+                    merged.append((cur_rank, Document(page_content=cur_text, metadata=dict(cur.metadata), id=cur.id)))
+                    cur_rank, cur, cur_start, cur_text = rank, doc, start, doc.page_content
+            merged.append((cur_rank, Document(page_content=cur_text, metadata=dict(cur.metadata), id=cur.id)))
+
+        merged.sort(key=lambda item: item[0])
+        return [doc for _, doc in merged]
+
+    def _drop_near_duplicates(self, docs: List[Document]) -> List[Document]:
+        kept, kept_shingles = [], []
+        for doc in docs:
+            shingles = _shingles(doc.page_content)
+            duplicate = any(
+                len(shingles & other) / len(shingles | other) >= self.dedup_threshold
+                for other in kept_shingles
+            )
+            if not duplicate:
+                kept.append(doc)
+                kept_shingles.append(shingles)
+        return kept
+
+    def pack(self, docs: List[Document]) -> List[Document]:
+        """返回在 token 预算内、按排名排序的切片列表"""
+        candidates = self._drop_near_duplicates(self._merge_adjacent(docs))
+        packed, used = [], 0
+        for doc in candidates:
+            tokens = estimate_tokens(doc.page_content)
+            if used + tokens <= self.token_budget:
+                packed.append(doc)
+                used += tokens
+            elif not packed:
+                # 排名第一的切片本身就超出预算时按比例截断，保证至少有一条参考内容
+                keep = int(len(doc.page_content) * self.token_budget / tokens)
+                packed.append(Document(page_content=doc.page_content[:keep], metadata=doc.metadata, id=doc.id))
+                used = estimate_tokens(packed[0].page_content)
+        logger.debug(f"上下文组装: 候选 {len(docs)} 条 -> 合并去重后 {len(candidates)} 条 -> 入选 {len(packed)} 条, "
+                    f"约 {used}/{self.token_budget} tokens")
+        return packed
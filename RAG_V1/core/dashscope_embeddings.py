@@ -0,0 +1,60 @@
+import asyncio
+from typing import List
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("DashScopeEmbeddings")
+
+# DashScope text-embedding 单次请求的最大文本条数
+_MAX_BATCH = 25
+
+
+class DashScopeHttpEmbeddings(Embeddings):
+    """
+    直接调用 DashScope Embedding HTTP 接口的实现，替代官方 SDK（SDK 每次调用都新建连接）：
+    - 同步方法（入库）与异步方法（问答链 ainvoke）分别使用 ModelFactory 管理的共享连接池，长连接复用
+    - 异步路径不占用线程池线程
+    """
+
+    def __init__(self, model: str, client: httpx.Client, async_client: httpx.AsyncClient, base_url: str):
+        self.model = model
+        self.client = client
+        self.async_client = async_client
+        self.url = f"{base_url.rstrip('/')}/services/embeddings/text-embedding/text-embedding"
+
+    def _payload(self, texts: List[str], text_type: str) -> dict:
+        return {"model": self.model, "input": {"texts": texts}, "parameters": {"text_type": text_type}}
+
+    @staticmethod
+    def _parse(response: httpx.Response) -> List[List[float]]:
+        if response.status_code != 200:
+            raise RuntimeError(f"DashScope Embedding 调用失败 (HTTP {response.status_code}): {response.text[:200]}")
+        embeddings = response.json()["output"]["embeddings"]
+        return [item["embedding"] for item in sorted(embeddings, key=lambda item: item["text_index"])]
+
+    def _embed(self, texts: List[str], text_type: str) -> List[List[float]]:
+        return self._parse(self.client.post(self.url, json=self._payload(texts, text_type)))
+
+    async def _aembed(self, texts: List[str], text_type: str) -> List[List[float]]:
+        return self._parse(await self.async_client.post(self.url, json=self._payload(texts, text_type)))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), _MAX_BATCH):
+            vectors.extend(self._embed(texts[i : i + _MAX_BATCH], "document"))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query")[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i : i + _MAX_BATCH] for i in range(0, len(texts), _MAX_BATCH)]
+        results = await asyncio.gather(*(self._aembed(batch, "document") for batch in batches))
+        return [vector for batch in results for vector in batch]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self._aembed([text], "query"))[0]
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("EmbeddingCache")
+
+# SQLite 单条语句的参数个数上限是 999，分批查询
+_SQLITE_MAX_VARS = 900
+
+
+def text_hash(text: str) -> str:
+    """切片内容的 SHA256 哈希，作为缓存键"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带持久化缓存的 Embedding 包装器：
+    - 文档向量按 (embedding_model, sha256(切片内容)) 存入 SQLite，重复入库时直接复用
+    - 查询向量在内存中做 LRU 缓存（检索与答案缓存会对同一问题各算一次）
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, db_path: str, query_cache_size: int = 1024):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.db_path = db_path
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._init_db()
+
+    def _init_db(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS embedding_cache
+                (model TEXT, text_hash TEXT, vector BLOB, PRIMARY KEY (model, text_hash))''')
+
+    def _load(self, hashes: List[str]) -> dict:
+        found = {}
+        with sqlite3.connect(self.db_path) as conn:
+            for i in range(0, len(hashes), _SQLITE_MAX_VARS):
+                batch = hashes[i : i + _SQLITE_MAX_VARS]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch],
+                )
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _save(self, items: dict):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?)",
+                [(self.model_name, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()],
+            )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        cached = self._load(list(set(hashes)))
+
+        # 只对未命中的内容调用 API，同一批次内的重复内容只算一次
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._save(computed)
+            cached.update(computed)
+
+        # 入库时多个批次并发调用 embed_documents，计数与查询 LRU 共用同一把锁
+        with self._query_lock:
+            self._stats["hits"] += len(texts) - len(missing)
+            self._stats["misses"] += len(missing)
+        logger.info(f"Embedding 缓存: 共 {len(texts)} 条，命中 {len(texts) - len(missing)} 条，新计算 {len(missing)} 条")
+        return [cached[h] for h in hashes]
+
+    def _get_query(self, text: str):
+        with self._query_lock:
+            if text in self._query_cache:
+                self._query_cache.move_to_end(text)
+                return self._query_cache[text]
+        return None
+
+    def _put_query(self, text: str, vector: List[float]):
+        with self._query_lock:
+            self._query_cache[text] = vector
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._get_query(text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._put_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._get_query(text)
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            self._put_query(text, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self._query_lock:
+            return dict(self._stats)
@@ -0,0 +1,245 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("HistoryStore")
+
+# 持久层清理（过期会话、超出会话数上限）的最小间隔（秒）
+_PRUNE_INTERVAL_SECONDS = 300
+
+
+class _CachedSession:
+    __slots__ = ("messages", "size", "last_access", "last_id")
+
+    def __init__(self, messages, window: int, last_id: int = 0):
+        self.messages = deque(messages, maxlen=window)
+        self.size = sum(_message_size(m) for m in self.messages)
+        self.last_access = time.time()
+        # 缓存对应的持久层最新消息 id，用于发现其他 worker 追加的消息
+        self.last_id = last_id
+
+
+def _message_size(message: BaseMessage) -> int:
+    """消息内容的 UTF-8 字节数（max_bytes 按字节计）"""
+    content = message.content
+    text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+    return len(text.encode("utf-8"))
+
+
+class HistoryStore:
+    """
+    会话历史两级存储：
+    - 内存层：按会话缓存最近 window 条消息（deque 定长，读写均 O(1)），LRU + TTL 淘汰，
+      总会话数与总内容大小都有上限
+    - 持久层（可选）：SQLite 追加写，每条消息一行，按 (session_id, id) 索引倒序取最近 window 条
+    db_path 为 None 时只使用内存层。启用持久层时以 SQLite 为准：
+    - 写入后把新消息追加到缓存并推进 last_id；写入前持久层已有缓存之外的消息时改为丢弃缓存
+    - shared=True（多 worker 共享同一数据库）时每次读取先查询会话的最新消息 id（索引点查），
+      与缓存不一致（其他 worker 写入了同一会话）才重新加载；单 worker 时缓存即最新，不再查询
+    - 持久层同样受限：每个会话只保留最近 window 条，定期删除超过 ttl 未活跃的会话与超出 max_sessions 的最久未活跃会话
+    """
+
+    def __init__(self, db_path: Optional[str] = None, window: int = 10, max_sessions: int = 10000,
+                 ttl_seconds: float = 3600, max_bytes: int = 64 * 1024 * 1024, shared: bool = False):
+        self.db_path = db_path
+        self.window = window
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._sessions = OrderedDict()  # session_id -> _CachedSession
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._init_db()
+
+    def _init_db(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS chat_messages
+                (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, message TEXT, created_at REAL)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, id)")
+
+    def _load_window(self, session_id: str) -> _CachedSession:
+        if not self.db_path:
+            return _CachedSession([], self.window)
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT id, message FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, self.window),
+            ).fetchall()
+        messages = messages_from_dict([json.loads(row[1]) for row in reversed(rows)])
+        return _CachedSession(messages, self.window, last_id=rows[0][0] if rows else 0)
+
+    def _latest_id(self, session_id: str) -> Optional[int]:
+        """持久层中该会话最新一条消息的 id（走 (session_id, id) 索引），未启用持久层返回 None"""
+        if not self.db_path:
+            return None
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT MAX(id) FROM chat_messages WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] or 0
+
+    def _evict(self, now: float):
+        """淘汰过期会话，再按 LRU 淘汰直到会话数与内容大小都回到上限以内（调用方持锁）"""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            expired = now - session.last_access > self.ttl_seconds
+            over_limit = len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes
+            if not (expired or over_limit):
+                break
+            self._sessions.popitem(last=False)
+            self._total_bytes -= session.size
+
+    def _drop(self, session_id: str):
+        """丢弃会话缓存（调用方持锁）"""
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._total_bytes -= session.size
+
+    def _get_cached(self, session_id: str, latest_id: Optional[int] = None) -> _CachedSession:
+        """
+        取内存中的会话，未命中、过期或落后于持久层（latest_id 与缓存不一致）时
+        从持久层加载最近 window 条（调用方持锁）
+        """
+        now = time.time()
+        session = self._sessions.get(session_id)
+        if session is not None and (now - session.last_access > self.ttl_seconds
+                                    or (latest_id is not None and latest_id != session.last_id)):
+            self._drop(session_id)
+            session = None
+        if session is None:
+            session = self._load_window(session_id)
+            self._sessions[session_id] = session
+            self._total_bytes += session.size
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        self._evict(now)
+        return session
+
+    def get_messages(self, session_id: str) -> List[BaseMessage]:
+        latest_id = self._latest_id(session_id) if self.shared else None
+        with self._lock:
+            return list(self._get_cached(session_id, latest_id).messages)
+
+    def _extend(self, session: _CachedSession, messages: Sequence[BaseMessage]):
+        """把消息追加到缓存的会话，超出 window 的旧消息随 deque 淘汰（调用方持锁）"""
+        for message in messages:
+            if len(session.messages) == session.messages.maxlen:
+                session.size -= _message_size(session.messages[0])
+                self._total_bytes -= _message_size(session.messages[0])
+            session.messages.append(message)
+            session.size += _message_size(message)
+            self._total_bytes += _message_size(message)
+
+    def _insert(self, session_id: str, messages: Sequence[BaseMessage]):
+        """
+        写入持久层并裁剪该会话到最近 window 条，返回 (写入前的最新 id, 写入后的最新 id)；
+        同一事务内完成，其他 worker 的写入不会夹在中间
+        """
+        now = time.time()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.execute("SELECT MAX(id) FROM chat_messages WHERE session_id = ?",
+                                  (session_id,)).fetchone()[0] or 0
+            last_id = before
+            for message in messages:
+                last_id = conn.execute(
+                    "INSERT INTO chat_messages (session_id, message, created_at) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(message_to_dict(message), ensure_ascii=False), now),
+                ).lastrowid
+            # 读取只用到最近 window 条，更早的消息直接删除
+            conn.execute(
+                """DELETE FROM chat_messages WHERE session_id = ? AND id <= (
+                       SELECT id FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+                (session_id, session_id, self.window),
+            )
+        return before, last_id
+
+    def _prune_db(self):
+        """删除超过 ttl 未活跃的会话，以及超出 max_sessions 的最久未活跃会话（最多每 _PRUNE_INTERVAL_SECONDS 秒一次）"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < _PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune = now
+        with sqlite3.connect(self.db_path) as conn:
+            expired = conn.execute(
+                """DELETE FROM chat_messages WHERE session_id IN (
+                       SELECT session_id FROM chat_messages GROUP BY session_id HAVING MAX(created_at) < ?)""",
+                (now - self.ttl_seconds,),
+            ).rowcount
+            overflow = conn.execute(
+                """DELETE FROM chat_messages WHERE session_id IN (
+                       SELECT session_id FROM chat_messages GROUP BY session_id
+                       ORDER BY MAX(id) DESC LIMIT -1 OFFSET ?)""",
+                (self.max_sessions,),
+            ).rowcount
+        if expired or overflow:
+            logger.info(f"清理会话历史: 过期 {expired} 条, 超出会话数上限 {overflow} 条")
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]):
+        if not self.db_path:
+            with self._lock:
+                self._extend(self._get_cached(session_id), messages)
+                self._evict(time.time())
+            return
+        before, last_id = self._insert(session_id, messages)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if session.last_id == before:
+                    self._extend(session, messages)
+                    session.last_id = last_id
+                    session.last_access = time.time()
+                    self._sessions.move_to_end(session_id)
+                    self._evict(session.last_access)
+                else:
+                    # 写入前持久层已有缓存之外的消息（其他 worker 写入），下次读取时重新加载
+                    self._drop(session_id)
+        self._prune_db()
+
+    def clear(self, session_id: str):
+        if self.db_path:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+        with self._lock:
+            self._drop(session_id)
+
+    def get_session_history(self, session_id: str) -> "SessionHistory":
+        """供 RunnableWithMessageHistory 使用的工厂函数"""
+        return SessionHistory(self, session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached_sessions": len(self._sessions), "cached_bytes": self._total_bytes,
+                    "durable": bool(self.db_path)}
+
+
+class SessionHistory(BaseChatMessageHistory):
+    """单个会话的历史视图，读写都委托给 HistoryStore"""
+
+    def __init__(self, store: HistoryStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.get_messages(self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
@@ -0,0 +1,67 @@
+from typing import Callable, Optional
+
+from .config import settings
+from utils.logger import setup_logger
+
+
+logger = setup_logger("HnswIndex")
+
+# 只能在创建 collection 时指定的参数，修改后必须重建
+CREATION_ONLY_PARAMS = ("space", "max_neighbors", "ef_construction")
+# 可以直接修改已有 collection 的参数
+RUNTIME_PARAMS = ("ef_search", "batch_size", "sync_threshold")
+
+
+def hnsw_configuration(space: Optional[str] = None, m: Optional[int] = None,
+                       construction_ef: Optional[int] = None, search_ef: Optional[int] = None,
+                       batch_size: Optional[int] = None, sync_threshold: Optional[int] = None) -> dict:
+    """创建 collection 用的 HNSW 配置，未指定的参数取 settings.hnsw_*"""
+    return {"hnsw": {
+        "space": space or settings.hnsw_space,
+        "max_neighbors": m or settings.hnsw_m,
+        "ef_construction": construction_ef or settings.hnsw_construction_ef,
+        "ef_search": search_ef or settings.hnsw_search_ef,
+        "batch_size": batch_size or settings.hnsw_batch_size,
+        "sync_threshold": sync_threshold or settings.hnsw_sync_threshold,
+    }}
+
+
+def sync_hnsw_params(collection, configuration: Optional[dict] = None):
+    """
+    把可在线修改的参数（search_ef、批量与落盘阈值）同步到已有 collection；
+    创建时参数与配置不一致时只告警，需离线重建才能生效
+    """
+    wanted = (configuration or hnsw_configuration())["hnsw"]
+    current = (getattr(collection, "configuration", None) or {}).get("hnsw") or {}
+    stale = [k for k in CREATION_ONLY_PARAMS if k in current and current[k] != wanted[k]]
+    if stale:
+        logger.warning(f"collection {collection.name} 的 HNSW 参数 {', '.join(f'{k}={current[k]}' for k in stale)} "
+                       f"与配置不一致，需执行 python -m utils.rebuild_collection 重建后生效")
+    changes = {k: wanted[k] for k in RUNTIME_PARAMS if current.get(k) != wanted[k]}
+    if not changes:
+        return
+    try:
+        collection.modify(configuration={"hnsw": changes})
+        logger.info(f"已更新 collection {collection.name} 的 HNSW 参数: {changes}")
+    except Exception as e:
+        logger.warning(f"更新 collection {collection.name} 的 HNSW 参数失败: {e}")
+
+
+def copy_collection(source, target, batch_size: int = 5000,
+                    progress_callback: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    按批把 source 的 id、向量、原文与元数据原样写入 target，不重新调用 Embedding 接口。
+    progress_callback(已复制数, 总数) 在每批写入后回调，返回复制的条数
+    """
+    total = source.count()
+    copied = 0
+    while copied < total:
+        batch = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=copied)
+        if not batch["ids"]:
+            break
+        target.add(ids=batch["ids"], embeddings=batch["embeddings"],
+                   documents=batch["documents"], metadatas=batch["metadatas"])
+        copied += len(batch["ids"])
+        if progress_callback:
+            progress_callback(copied, total)
+    return copied
@@ -0,0 +1,276 @@
+import asyncio
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("HybridRetriever")
+
+# 英文/数字按词切分（保留 E-1024、v2.1、AB_12 这类型号整体），中日韩文字按连续片段切分
+_TOKEN_PATTERN = re.compile(
+    r"[a-z0-9]+(?:[-_./][a-z0-9]+)*"
+    r"|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+"
+)
+_CODE_SEPARATORS = re.compile(r"[-_./]")
+
+# 词法检索在独立线程中执行，与向量检索并行
+_LEXICAL_WORKERS = 4
+_lexical_executor = ThreadPoolExecutor(max_workers=_LEXICAL_WORKERS, thread_name_prefix="bm25")
+# 在途词法检索数不超过线程数：线程全忙时直接跳过该路，不让任务在队列中堆积（排队的任务注定超时）
+_lexical_slots = threading.BoundedSemaphore(_LEXICAL_WORKERS)
+# 打分过程中每处理这么多条倒排记录检查一次截止时间
+_DEADLINE_CHECK_EVERY = 2048
+
+
+def _submit_lexical(fn, *args):
+    """提交词法检索，线程全忙时返回 None"""
+    if not _lexical_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _lexical_executor.submit(fn, *args)
+    except BaseException:
+        _lexical_slots.release()
+        raise
+    future.add_done_callback(lambda _: _lexical_slots.release())
+    return future
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    CJK 感知的分词：中日韩文字切成二元组（单字保留原样），
+    英文/数字转小写整体保留，带分隔符的型号额外拆出各段，便于部分匹配
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if token[0].isascii():
+            tokens.append(token)
+            if _CODE_SEPARATORS.search(token):
+                tokens.extend(p for p in _CODE_SEPARATORS.split(token) if p)
+        elif len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i : i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    增量维护的 BM25 倒排索引，与 Chroma 中的切片一一对应（以 Chroma id 为键），
+    支持按 file_hash 批量删除。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs = {}  # doc_id -> Document
+        self._doc_lengths = {}  # doc_id -> 词数
+        self._postings = defaultdict(dict)  # term -> {doc_id: tf}
+        self._file_docs = defaultdict(set)  # file_hash -> {doc_id}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        # 后台全量重建期间记录本进程的增删操作，替换前在新索引上重放，避免快照之后的写入丢失
+        self._journal = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    @classmethod
+    def from_collection(cls, collection, page_size: int = 5000) -> "BM25Index":
+        """从已有的 Chroma collection 分页加载全部切片构建索引"""
+        index = cls()
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            ids = page["ids"]
+            if not ids:
+                break
+            docs = [
+                Document(page_content=text or "", metadata=meta or {}, id=doc_id)
+                for doc_id, text, meta in zip(ids, page["documents"], page["metadatas"])
+            ]
+            index.add(ids, docs)
+            offset += len(ids)
+        logger.info(f"BM25 索引构建完成，共 {len(index)} 个切片")
+        return index
+
+    def reload(self, collection):
+        """
+        从 collection 重新全量构建并原地替换（其他进程修改了知识库时使用），检索器持有的引用保持有效。
+        构建期间本进程的 add / remove_file 会记录下来，替换前按顺序在新索引上重放
+        """
+        with self._lock:
+            self._journal = []
+        try:
+            fresh = BM25Index.from_collection(collection)
+        except BaseException:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            for operation, args in self._journal:
+                getattr(fresh, operation)(*args)
+            self._journal = None
+            self._docs = fresh._docs
+            self._doc_lengths = fresh._doc_lengths
+            self._postings = fresh._postings
+            self._file_docs = fresh._file_docs
+            self._total_length = fresh._total_length
+
+    def add(self, ids: List[str], documents: List[Document]):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("add", (list(ids), list(documents))))
+            for doc_id, doc in zip(ids, documents):
+                if doc_id in self._docs:
+                    self._remove(doc_id)
+                tf = Counter(tokenize(doc.page_content))
+                length = sum(tf.values())
+                for term, count in tf.items():
+                    self._postings[term][doc_id] = count
+                self._docs[doc_id] = Document(page_content=doc.page_content, metadata=dict(doc.metadata), id=doc_id)
+                self._doc_lengths[doc_id] = length
+                self._total_length += length
+                file_hash = doc.metadata.get("file_hash")
+                if file_hash:
+                    self._file_docs[file_hash].add(doc_id)
+
+    def _remove(self, doc_id: str):
+        doc = self._docs.pop(doc_id)
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in set(tokenize(doc.page_content)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def remove_file(self, file_hash: str):
+        """删除某个文件的全部切片"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("remove_file", (file_hash,)))
+            for doc_id in self._file_docs.pop(file_hash, set()):
+                if doc_id in self._docs:
+                    self._remove(doc_id)
+
+    def search(self, query: str, k: int, deadline: Optional[float] = None) -> Optional[List[Document]]:
+        """
+        返回 BM25 得分最高的 k 个切片（按得分降序）。
+        deadline 为 time.monotonic() 截止时间，打分过程中超过截止时间即放弃并返回 None，及时释放线程
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._docs)
+            if not n or not terms:
+                return []
+            avg_length = self._total_length / n
+            scores = defaultdict(float)
+            processed = 0
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+                    processed += 1
+                    if deadline is not None and processed % _DEADLINE_CHECK_EVERY == 0 \
+                            and time.monotonic() > deadline:
+                        return None
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [self._docs[doc_id] for doc_id, _ in top]
+
+
+def _doc_key(doc: Document) -> str:
+    return doc.id or doc.page_content
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """倒数排名融合：score(d) = Σ 1 / (rrf_k + rank)，取前 k 个"""
+    scores = defaultdict(float)
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = _doc_key(doc)
+            scores[key] += 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    稠密向量 + BM25 混合检索：两路并行召回 fetch_k 个候选，倒数排名融合后返回 k 个。
+    词法检索从提交起超过 lexical_timeout_ms（检索线程内按截止时间主动中止），
+    或词法检索线程全忙时，放弃该路，只用向量结果，保证延迟可控。
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_index: Any
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    lexical_timeout_ms: float = 50
+
+    def _timed_search(self, query: str, deadline: float):
+        start = time.perf_counter()
+        results = self.lexical_index.search(query, self.fetch_k, deadline=deadline)
+        return results, (time.perf_counter() - start) * 1000
+
+    def _lexical_results(self, outcome) -> List[Document]:
+        """outcome 为 (结果, 耗时) 或 None（超时/线程全忙）"""
+        if outcome is None or outcome[0] is None:
+            logger.warning(f"BM25 检索超过 {self.lexical_timeout_ms}ms 预算，本次仅使用向量检索结果")
+            return []
+        lexical, cost = outcome
+        logger.debug(f"BM25 检索耗时 {cost:.1f}ms，命中 {len(lexical)} 条")
+        return lexical
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        deadline = time.monotonic() + self.lexical_timeout_ms / 1000
+        future = _submit_lexical(self._timed_search, query, deadline)
+        if future is None:
+            logger.warning("BM25 检索线程全忙，本次仅使用向量检索结果")
+        dense = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        lexical = []
+        if future is not None:
+            try:
+                outcome = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                outcome = None
+            lexical = self._lexical_results(outcome)
+        return reciprocal_rank_fusion([dense, lexical], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        deadline = time.monotonic() + self.lexical_timeout_ms / 1000
+        future = _submit_lexical(self._timed_search, query, deadline)
+        if future is None:
+            logger.warning("BM25 检索线程全忙，本次仅使用向量检索结果")
+        dense = await self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        lexical = []
+        if future is not None:
+            try:
+                # shield：等待超时只放弃结果，不取消检索线程中的任务（由截止时间自行中止）
+                outcome = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                                 timeout=max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                outcome = None
+            lexical = self._lexical_results(outcome)
+        return reciprocal_rank_fusion([dense, lexical], self.k, self.rrf_k)
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("IngestJobs")
+
+_JOB_FIELDS = ("stage", "chunks_total", "chunks_done", "chunks_per_second", "error")
+
+
+def _pid_alive(pid) -> bool:
+    """判断登记任务的 worker 进程是否仍在运行"""
+    if not pid or pid == os.getpid():
+        # 当前进程刚启动，不可能有属于自己的未完成任务
+        return False
+    if os.name == "nt":
+        # Windows 上 os.kill 会直接结束进程，无法用来探测，按已退出处理
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestJobManager:
+    """
+    后台入库任务队列：上传接口只负责保存文件并登记任务，解析/切片/向量化在本地线程池中执行。
+    任务状态持久化在 file_registry.db 的 ingest_jobs 表中，服务重启后仍可查询，
+    多 worker 部署时任意 worker 都能查询到其他 worker 登记的任务。
+    """
+
+    def __init__(self, doc_processor, db_path: str, max_workers: int = 2):
+        self.doc_processor = doc_processor
+        self.db_path = db_path
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS ingest_jobs
+                (job_id TEXT PRIMARY KEY, file_name TEXT, file_hash TEXT, status TEXT, stage TEXT,
+                 chunks_total INTEGER, chunks_done INTEGER, chunks_per_second REAL, error TEXT,
+                 created_at TEXT, updated_at TEXT, worker_pid INTEGER)''')
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(ingest_jobs)")}
+            if "worker_pid" not in columns:
+                conn.execute("ALTER TABLE ingest_jobs ADD COLUMN worker_pid INTEGER")
+            # 所属进程已退出的未完成任务无法继续（临时文件已不可靠），标记为中断；
+            # 多 worker 部署时其他存活 worker 的任务不受影响
+            unfinished = conn.execute(
+                "SELECT job_id, worker_pid FROM ingest_jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            stale = [(job_id,) for job_id, pid in unfinished if not _pid_alive(pid)]
+            conn.executemany("UPDATE ingest_jobs SET status = 'interrupted' WHERE job_id = ?", stale)
+
+    def _now(self) -> str:
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = self._now()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock, sqlite3.connect(self.db_path) as conn:
+            conn.execute(f"UPDATE ingest_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def submit(self, file_path: str, file_name: str, file_hash: str) -> str:
+        """登记任务并放入线程池，立即返回 job_id"""
+        job_id = str(uuid.uuid4())
+        now = self._now()
+        with self._lock, sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO ingest_jobs VALUES (?, ?, ?, 'queued', 'queued', 0, 0, 0, NULL, ?, ?, ?)",
+                (job_id, file_name, file_hash, now, now, os.getpid()),
+            )
+        self._pool.submit(self._run, job_id, file_path, file_name, file_hash)
+        logger.info(f"入库任务已排队: {job_id} ({file_name})")
+        return job_id
+
+    def _run(self, job_id: str, file_path: str, file_name: str, file_hash: str):
+        start = time.perf_counter()
+        self._update(job_id, status="running")
+
+        def on_progress(stage, **fields):
+            done = fields.get("chunks_done")
+            if done:
+                elapsed = time.perf_counter() - start
+                fields["chunks_per_second"] = round(done / elapsed, 1) if elapsed > 0 else 0.0
+            self._update(job_id, stage=stage, **{k: v for k, v in fields.items() if k in _JOB_FIELDS})
+
+        try:
+            result = self.doc_processor.ingest_file(file_path, file_name, file_hash, progress_callback=on_progress)
+            self._update(job_id, status="success", stage="done",
+                         chunks_done=result["chunks"], chunks_per_second=result["chunks_per_second"])
+            logger.info(f"入库任务完成: {job_id} ({file_name})")
+        except Exception as e:
+            logger.error(f"入库任务失败: {job_id} ({file_name}): {e}", exc_info=True)
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def get_job(self, job_id: str):
+        """查询任务状态，不存在返回 None"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,196 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 各阶段耗时的直方图分桶（秒）
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 参考内容 token 数的直方图分桶
+_TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+
+
+def _label_str(labelnames: Sequence[str], values: tuple) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in zip(labelnames, values))
+
+
+class Histogram:
+    """Prometheus 直方图（累积分桶），按标签值分组，线程安全"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = _LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [各分桶计数..., +Inf 计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(labelvalues, [0] * (len(self.buckets) + 1) + [0.0])
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labelvalues, counts in sorted(series.items()):
+            labels = _label_str(self.labelnames, labelvalues)
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {counts[-1]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Prometheus 计数器，按标签值分组，线程安全"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            labels = _label_str(self.labelnames, labelvalues)
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "RAG 各阶段耗时（秒）", ["stage"])
+REQUEST_SECONDS = Histogram("rag_request_seconds", "HTTP 请求总耗时（秒）", ["endpoint", "status"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM 消耗的 token 数", ["stage", "type"])
+CONTEXT_TOKENS = Histogram("rag_context_tokens", "每次送入 Prompt 的参考内容 token 数（估算）", ["variant"],
+                           buckets=_TOKEN_BUCKETS)
+
+_REGISTRY = [STAGE_SECONDS, REQUEST_SECONDS, LLM_TOKENS, CONTEXT_TOKENS]
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录代码块耗时到 rag_stage_seconds{stage=...}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """装饰器：记录函数每次调用的耗时"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics() -> str:
+    """Prometheus 文本格式（仅本进程的数据）"""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _token_usage(response) -> Optional[Dict[str, int]]:
+    """从 LLMResult 中取 token 用量：兼容 llm_output.token_usage、usage_metadata 与 response_metadata.token_usage"""
+    usage = (response.llm_output or {}).get("token_usage")
+    if usage:
+        return {"prompt": usage.get("prompt_tokens", usage.get("input_tokens", 0)),
+                "completion": usage.get("completion_tokens", usage.get("output_tokens", 0))}
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is None:
+                continue
+            if getattr(message, "usage_metadata", None):
+                meta = message.usage_metadata
+                return {"prompt": meta.get("input_tokens", 0), "completion": meta.get("output_tokens", 0)}
+            usage = message.response_metadata.get("token_usage")
+            if usage:
+                return {"prompt": usage.get("prompt_tokens", usage.get("input_tokens", 0)),
+                        "completion": usage.get("completion_tokens", usage.get("output_tokens", 0))}
+    return None
+
+
+class LLMMetricsCallbackHandler(BaseCallbackHandler):
+    """
+    按 LLM 调用统计首 token 延迟、完整生成耗时与 token 用量。
+    阶段名取自调用上的 stage:<name> 标签（如 stage:rewrite、stage:generation）。
+    """
+
+    def __init__(self):
+        self._runs = {}  # run_id -> [stage, 开始时间, 是否已收到首 token]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stage(tags: Optional[list]) -> Optional[str]:
+        for tag in tags or []:
+            if tag.startswith("stage:"):
+                return tag[len("stage:"):]
+        return None
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID,
+                            tags: Optional[list] = None, **kwargs: Any) -> None:
+        self.on_llm_start(serialized, [], run_id=run_id, tags=tags)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, *, run_id: UUID,
+                     tags: Optional[list] = None, **kwargs: Any) -> None:
+        stage = self._stage(tags)
+        if stage:
+            with self._lock:
+                self._runs[run_id] = [stage, time.perf_counter(), False]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run[2]:
+                return
+            run[2] = True
+        if run[0] == "generation":
+            observe_stage("first_token", time.perf_counter() - run[1])
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        observe_stage(run[0], time.perf_counter() - run[1])
+        usage = _token_usage(response)
+        if usage:
+            LLM_TOKENS.inc(usage["prompt"], run[0], "prompt")
+            LLM_TOKENS.inc(usage["completion"], run[0], "completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._runs.pop(run_id, None)
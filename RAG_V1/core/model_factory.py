@@ -1,25 +1,179 @@
-import dashscope
-from langchain_community.chat_models import ChatTongyi
-from langchain_community.embeddings import DashScopeEmbeddings
+import importlib.util
+import os
+import threading
+
+import httpx
 from .config import settings
+from .embedding_cache import CachedEmbeddings
+from .dashscope_embeddings import DashScopeHttpEmbeddings
+from .context_packer import estimate_tokens
+from .rate_limiter import AdaptiveLimiter, LimitedAsyncTransport, LimitedTransport, RetryBudget
+from utils.logger import setup_logger
+
+
+logger = setup_logger("ModelFactory")
+
 
 class ModelFactory:
-    """模型工厂类，负责初始化 LLM 和 Embedding 模型"""
-    
+    """
+    模型工厂类，负责初始化 LLM 和 Embedding 模型。
+    LLM 与 Embedding 在进程内各只创建一次，所有调用方（RAGEngine、VectorManager、入库任务）共享；
+    底层 HTTP 连接池按用途（chat / embedding）分别管理，保持长连接，避免每次请求重新握手。
+    """
+
+    _lock = threading.Lock()
+    _http_clients = {}  # purpose -> (httpx.Client, httpx.AsyncClient)
+    _limiters = {}  # purpose -> AdaptiveLimiter
+    _llm = None
+    _embedding = None
+
     @staticmethod
-    def get_llm():
-        return ChatTongyi(
-            model=settings.llm_model,
-            dashscope_api_key=settings.dashscope_api_key,
-            streaming=True,  # 支持流式输出
-            temperature=0.3,
-            # 阿里官方 SDK 有时会有连接抖动，在这里可以配置底层重试逻辑
-            max_retries=3
-        )
+    def _http2_available() -> bool:
+        # httpx 的 HTTP/2 支持依赖 h2 包，未安装时退回 HTTP/1.1 keep-alive
+        return settings.http2_enabled and importlib.util.find_spec("h2") is not None
 
     @staticmethod
-    def get_embedding():
-        return DashScopeEmbeddings(
+    def _request_tokens(purpose: str):
+        """按请求体粗略估算本次调用消耗的 token 数（供 TPM 令牌桶使用）"""
+        reserve = settings.llm_expected_output_tokens if purpose == "chat" else 0
+
+        def estimate(request: httpx.Request) -> float:
+            try:
+                body = request.content.decode("utf-8")
+            except (httpx.RequestNotRead, UnicodeDecodeError):
+                body = ""
+            return estimate_tokens(body) + reserve
+        return estimate
+
+    @classmethod
+    def _get_limiter(cls, purpose: str) -> AdaptiveLimiter:
+        """每类流量一个限流器（调用方持锁）"""
+        if purpose not in cls._limiters:
+            if purpose == "chat":
+                rpm, tpm, concurrency = settings.llm_rpm, settings.llm_tpm, settings.llm_max_concurrency
+            else:
+                rpm, tpm, concurrency = settings.embedding_rpm, settings.embedding_tpm, settings.embedding_max_concurrency
+            cls._limiters[purpose] = AdaptiveLimiter(
+                purpose, rpm=rpm, tpm=tpm, max_concurrency=concurrency,
+                min_concurrency=settings.limiter_min_concurrency,
+                queue_timeout=settings.limiter_queue_timeout_seconds,
+                max_retries=settings.limiter_max_retries,
+                retry_budget=RetryBudget(ratio=settings.retry_budget_ratio),
+            )
+        return cls._limiters[purpose]
+
+    @classmethod
+    def limiter_stats(cls) -> dict:
+        """各限流器的排队深度、并发上限、丢弃与重试次数"""
+        with cls._lock:
+            limiters = dict(cls._limiters)
+        return {purpose: limiter.stats() for purpose, limiter in limiters.items()}
+
+    @classmethod
+    def get_http_clients(cls, purpose: str):
+        """获取某类流量（chat / embedding）共享的同步与异步 HTTP 客户端"""
+        with cls._lock:
+            if purpose not in cls._http_clients:
+                if purpose == "chat":
+                    pool_size, timeout = settings.llm_http_pool_size, settings.llm_timeout_seconds
+                else:
+                    pool_size, timeout = settings.embedding_http_pool_size, settings.embedding_http_timeout_seconds
+                http2 = cls._http2_available()
+                pool = dict(
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                        keepalive_expiry=settings.http_keepalive_seconds),
+                    http2=http2,
+                )
+                transport, async_transport = httpx.HTTPTransport(**pool), httpx.AsyncHTTPTransport(**pool)
+                if settings.limiter_enabled:
+                    # 限流与重试放在传输层：LLM SDK 自身的重试关闭，所有重试都受同一个重试预算约束
+                    limiter, estimate = cls._get_limiter(purpose), cls._request_tokens(purpose)
+                    transport = LimitedTransport(transport, limiter, estimate)
+                    async_transport = LimitedAsyncTransport(async_transport, limiter, estimate)
+                options = dict(
+                    headers={"Authorization": f"Bearer {settings.dashscope_api_key}"},
+                    timeout=httpx.Timeout(timeout, connect=settings.http_connect_timeout_seconds),
+                )
+                cls._http_clients[purpose] = (
+                    httpx.Client(transport=transport, **options),
+                    httpx.AsyncClient(transport=async_transport, **options),
+                )
+                logger.info(f"创建 {purpose} 连接池: 最大连接数 {pool_size}, 超时 {timeout}s, HTTP/2={http2}, "
+                            f"限流={settings.limiter_enabled}")
+            return cls._http_clients[purpose]
+
+    @classmethod
+    def get_llm(cls):
+        with cls._lock:
+            llm = cls._llm
+        if llm is not None:
+            return llm
+        if settings.llm_api == "tongyi":
+            # 旧实现：官方 SDK，不支持连接复用
+            from langchain_community.chat_models import ChatTongyi
+            llm = ChatTongyi(
+                model=settings.llm_model,
+                dashscope_api_key=settings.dashscope_api_key,
+                streaming=True,  # 支持流式输出
+                temperature=0.3,
+                # 阿里官方 SDK 有时会有连接抖动，在这里可以配置底层重试逻辑
+                max_retries=3
+            )
+        else:
+            # DashScope OpenAI 兼容接口，复用共享连接池
+            try:
+                from langchain_openai import ChatOpenAI
+            except ImportError as e:
+                raise ImportError("LLM_API=compatible 需要安装 langchain-openai: pip install langchain-openai") from e
+            client, async_client = cls.get_http_clients("chat")
+            llm = ChatOpenAI(
+                model=settings.llm_model,
+                api_key=settings.dashscope_api_key,
+                base_url=settings.llm_base_url,
+                http_client=client,
+                http_async_client=async_client,
+                streaming=True,  # 支持流式输出
+                temperature=0.3,
+                # 启用限流器时由传输层按重试预算统一重试
+                max_retries=0 if settings.limiter_enabled else 3,
+                stream_usage=True,
+            )
+        with cls._lock:
+            if cls._llm is None:
+                cls._llm = llm
+            return cls._llm
+
+    @classmethod
+    def get_embedding(cls):
+        with cls._lock:
+            embedding = cls._embedding
+        if embedding is not None:
+            return embedding
+        client, async_client = cls.get_http_clients("embedding")
+        embeddings = DashScopeHttpEmbeddings(
             model=settings.embedding_model,
-            dashscope_api_key=settings.dashscope_api_key
-        )
\ No newline at end of file
+            client=client,
+            async_client=async_client,
+            base_url=settings.dashscope_base_url,
+        )
+        if settings.embedding_cache_enabled:
+            # 按切片内容哈希持久化缓存向量，重复/增量入库时几乎不再调用 API
+            embeddings = CachedEmbeddings(
+                embeddings,
+                model_name=settings.embedding_model,
+                db_path=os.path.join(settings.chroma_persist_dir, "embedding_cache.db"),
+            )
+        with cls._lock:
+            if cls._embedding is None:
+                cls._embedding = embeddings
+            return cls._embedding
+
+    @classmethod
+    async def aclose(cls):
+        """关闭所有连接池（服务退出时调用）"""
+        with cls._lock:
+            clients, cls._http_clients = list(cls._http_clients.values()), {}
+            cls._llm = cls._embedding = None
+        for client, async_client in clients:
+            client.close()
+            await async_client.aclose()
@@ -1,21 +1,42 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnablePick, RunnableBranch
 from .model_factory import ModelFactory
 from .vector_manager import VectorManager
+from .answer_cache import AnswerCache, history_fingerprint, normalize_question
+from .context_packer import ContextPacker, estimate_tokens
+from .history_store import HistoryStore
+from .single_flight import SingleFlight
+from .metrics import CONTEXT_TOKENS, LLMMetricsCallbackHandler, timed
 from operator import itemgetter # 引入这个工具，专门用于从字典取值
 import json
+import logging
+import os
+import random
+import re
+import threading
+from .config import settings
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
 from utils.logger import setup_logger
 
 
 logger = setup_logger("RAGEngine")
 
+def _debug_sampled() -> bool:
+    """按 debug_sample_rate 采样，决定本次请求是否打印调试信息"""
+    return settings.debug_sample_rate > 0 and random.random() < settings.debug_sample_rate
+
+def debug_runnable(func):
+    """调试步骤：关闭调试时返回直通节点，热路径上不做任何字符串拼接与日志 I/O"""
+    if settings.debug_sample_rate <= 0:
+        return RunnablePassthrough()
+    return RunnableLambda(func)
+
 def print_debug_prompt(prompt) -> ChatPromptTemplate:
     """调试用，打印最终发送给 LLM 的 Prompt"""
-    logger = setup_logger("RAGEngine")
+    if not _debug_sampled():
+        return prompt
     logger.info("===== Prompt Start =====")
     logger.info(prompt.to_string())
     logger.info("===== Prompt End =====")
@@ -23,6 +44,8 @@ def print_debug_prompt(prompt) -> ChatPromptTemplate:
 
 def debug_step(data, step_name: str):
     """自定义调试函数，打印数据内容和类型"""
+    if not _debug_sampled():
+        return data
     logger.info(f"==== [DEBUG: {step_name}] Start ====")
     # 打印数据类型
     logger.info(f"Type: {type(data)}")
@@ -37,33 +60,102 @@ def debug_step(data, step_name: str):
     return data
 
 
-store = {}
+# 指代/承接类词语：出现这些词时问题通常依赖上文，需要改写
+_REFERENCE_PATTERN = re.compile(
+    r"它|这个|那个|这些|那些|这种|那种|这里|那里|上面|上述|刚才|之前|前面|其中"
+    r"|然后呢|还有呢|另外呢|继续"
+    r"|\b(it|its|this|that|these|those|they|them|he|she|above|previous)\b",
+    re.IGNORECASE,
+)
+
+def is_self_contained(query: str) -> bool:
+    """廉价启发式：问题足够长且不含指代词时，认为无需结合历史改写"""
+    query = query.strip()
+    if len(query) < settings.rewrite_min_query_length:
+        return False
+    return _REFERENCE_PATTERN.search(query) is None
 
-def get_session_history(session_id: str):
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    # 滑动窗口：保留最近 10 条（约 5 轮对话）
-    if len(store[session_id].messages) > 10:
-        recent = store[session_id].messages[-10:]
-        store[session_id].clear()
-        store[session_id].add_messages(recent)
-    return store[session_id]
 
 class RAGEngine:
-    def __init__(self):
-        self.llm = ModelFactory.get_llm()
-        self.vector_manager = VectorManager()
+    def __init__(self, llm=None, vector_manager=None):
+        # 允许注入 llm / vector_manager，便于压测时替换为本地假实现
+        self.llm = llm or ModelFactory.get_llm()
+        self.vector_manager = vector_manager or VectorManager()
         self.retriever = self.vector_manager.get_retriever()
+        # 会话历史：内存 LRU/TTL 层 + 可选的 SQLite 持久层，每个会话只保留最近 history_window 条（约 5 轮对话）
+        self.history_store = HistoryStore(
+            db_path=os.path.join(settings.chroma_persist_dir, "chat_history.db") if settings.history_backend == "sqlite" else None,
+            window=settings.history_window,
+            max_sessions=settings.history_max_sessions,
+            ttl_seconds=settings.history_ttl_seconds,
+            max_bytes=settings.history_max_bytes,
+            # 多 worker 共享 chat_history.db 时每次读取都与持久层比对最新消息 id
+            shared=settings.api_workers > 1,
+        )
+        # token 预算 > 0 时按预算组装上下文，否则沿用检索返回的固定 top_k 条
+        self.context_packer = None
+        if settings.context_token_budget > 0:
+            self.context_packer = ContextPacker(settings.context_token_budget, settings.context_dedup_threshold)
+        self.answer_cache = None
+        if settings.answer_cache_enabled:
+            self.answer_cache = AnswerCache(
+                embeddings=getattr(self.vector_manager, "embeddings", None),
+                max_size=settings.answer_cache_max_size,
+                ttl_seconds=settings.answer_cache_ttl_seconds,
+                similarity_threshold=settings.answer_cache_similarity_threshold,
+            )
+            # 知识库增删文档后，缓存的答案可能过期，需整体失效
+            self.vector_manager.add_change_listener(self.answer_cache.invalidate)
+        self.single_flight = SingleFlight() if settings.coalesce_enabled else None
+        # 按 LLM 调用统计改写/生成耗时、首 token 延迟与 token 用量（/metrics）
+        self.metrics_handler = LLMMetricsCallbackHandler()
+        # 问题改写统计：skipped=跳过改写, executed=实际调用 LLM 改写
+        self._rewrite_stats = {"skipped": 0, "executed": 0}
+        self._stats_lock = threading.Lock()
+        # 链在启动时编译一次并按变体缓存，请求期间只读复用（Runnable 本身无状态，可并发调用）
+        self._chains = {
+            "default": self._build_chain(),
+            "with_source": self._build_chain_with_source(),
+        }
+
+    def _stage_llm(self, stage: str):
+        """带阶段标签与指标回调的 LLM，用于区分改写与生成的耗时统计"""
+        return self.llm.with_config(tags=[f"stage:{stage}"], callbacks=[self.metrics_handler])
+
+    @timed("context_pack")
+    def _pack_docs(self, docs):
+        """合并相邻切片、去重，并按 token 预算截取"""
+        if self.context_packer is None:
+            return docs
+        return self.context_packer.pack(docs)
+
+    @staticmethod
+    def _count_context_tokens(context: str, variant: str) -> int:
+        """估算送入 Prompt 的参考内容 token 数，并记录到 rag_context_tokens{variant=...}"""
+        tokens = estimate_tokens(context)
+        CONTEXT_TOKENS.observe(tokens, variant)
+        return tokens
 
+    def _observe_context(self, variant: str):
+        """链中的透传步骤：记录参考内容 token 数后原样返回 context"""
+        def observe(context: str) -> str:
+            self._count_context_tokens(context, variant)
+            return context
+        return observe
+
+    @timed("context_format")
     def _format_docs(self, docs):
         """保持原有的去重与空结果处理逻辑"""
-        # 增加打印，方便在控制台调试
-        logger.info(f"--- 向量检索完成，命中数量: {len(docs)} ---")
+        # 命中明细只在 DEBUG 级别输出，默认级别下不做任何字符串拼接
+        verbose = logger.isEnabledFor(logging.DEBUG)
+        if verbose:
+            logger.debug(f"--- 向量检索完成，命中数量: {len(docs)} ---")
         seen = set()
         unique_docs = []
         for i, doc in enumerate(docs):
-             # 记录每条命中的内容预览和分值（如果有）
-            logger.info(f"命中片段 [{i}] 来源: {doc.metadata.get('file_name')} | 内容: {doc.page_content[:50]}...")
+            if verbose:
+                # 记录每条命中的内容预览和分值（如果有）
+                logger.debug(f"命中片段 [{i}] 来源: {doc.metadata.get('file_name')} | 内容: {doc.page_content[:50]}...")
             if doc.page_content not in seen:
                 unique_docs.append(doc.page_content)
                 seen.add(doc.page_content)
@@ -71,6 +163,8 @@ class RAGEngine:
             logger.warning("检索结果为空！可能是由于相似度阈值过滤了所有结果。")
             return "【暂无相关参考文档，请提示用户根据已知常识回答】"
         return "\n\n".join(unique_docs)
+
+    @timed("context_format")
     def _format_docs_with_sources(self, docs):
         """
         格式化文档，并在内容前注入 [编号] 和 文件名
@@ -86,12 +180,96 @@ class RAGEngine:
             return "【暂无参考资料】"
         
         return "\n\n".join(formatted_chunks)
+
+    def _needs_rewrite(self, data: dict) -> bool:
+        """路由判断：首轮对话（无历史）或问题可独立理解时跳过改写"""
+        need = bool(data.get("chat_history")) and not (
+            settings.rewrite_skip_self_contained and is_self_contained(data["input"])
+        )
+        with self._stats_lock:
+            self._rewrite_stats["executed" if need else "skipped"] += 1
+        return need
+
+    def _route_rewrite(self, condense_question_chain):
+        """条件路由：需要时走改写子链，否则直接使用原始问题，省掉一次 LLM 往返"""
+        return RunnableBranch(
+            (RunnableLambda(self._needs_rewrite), condense_question_chain),
+            itemgetter("input"),
+        )
+
+    def _with_single_flight(self, variant: str, answer_chain):
+        """
+        "检索 + 生成" 子链的请求合并：独立问题（归一化后）、会话历史与知识库版本都相同的并发请求共享一次执行，
+        流式输出同时推送给所有等待者。回答 Prompt 包含 chat_history，历史不同的会话不能共享回答。同步 invoke 不合并。
+        """
+        if self.single_flight is None:
+            return answer_chain
+
+        def invoke(data, config):
+            return answer_chain.invoke(data, config)
+
+        async def coalesced(data, config):
+            key = (variant, normalize_question(data["standalone_question"]),
+                   history_fingerprint(data.get("chat_history")), getattr(self.vector_manager, "corpus_version", 0))
+            async for chunk in self.single_flight.stream(key, lambda: answer_chain.astream(data, config)):
+                yield chunk
+
+        return RunnableLambda(invoke, afunc=coalesced, name=f"single_flight_{variant}")
+
+    def _with_answer_cache(self, variant: str, answer_chain):
+        """
+        在 "检索 + 生成" 子链前加答案缓存：按 (会话历史, 独立问题) 查缓存，命中则直接返回，
+        未命中则执行子链（相同的并发请求合并为一次），并在子链结束（含流式输出结束）后回填缓存
+        """
+        if self.answer_cache is None:
+            return self._with_single_flight(variant, answer_chain)
+
+        def lookup(data):
+            return self.answer_cache.get(settings.collection_name, variant, data["standalone_question"],
+                                         history=history_fingerprint(data.get("chat_history")))
+
+        async def alookup(data):
+            return await self.answer_cache.aget(settings.collection_name, variant, data["standalone_question"],
+                                                history=history_fingerprint(data.get("chat_history")))
+
+        def store(run):
+            outputs = run.outputs or {}
+            # 非字典输出会被包装成 {"output": ...}
+            value = outputs.get("output", outputs)
+            if value:
+                inputs = run.inputs
+                # 带上查找结果：复用已算好的问题向量，查找后缓存已失效则不写回
+                self.answer_cache.put(settings.collection_name, variant, inputs["standalone_question"], value,
+                                      history=history_fingerprint(inputs.get("chat_history")),
+                                      lookup=inputs.get("cache_lookup"))
+
+        return (
+            RunnablePassthrough.assign(cache_lookup=RunnableLambda(lookup, afunc=alookup))
+            | RunnableBranch(
+                (lambda x: x["cache_lookup"].value is not None, lambda x: x["cache_lookup"].value),
+                self._with_single_flight(variant, answer_chain.with_listeners(on_end=store)),
+            )
+        )
+
+    def get_rewrite_stats(self) -> dict:
+        """返回问题改写的跳过/执行次数"""
+        with self._stats_lock:
+            return dict(self._rewrite_stats)
+
     def get_chain(self):
+        """获取（已缓存的）基础 RAG 链"""
+        return self._chains["default"]
+
+    def get_chain_with_source(self):
+        """获取（已缓存的）带来源的 RAG 链，输出 {answer, raw_docs, context_tokens}"""
+        return self._chains["with_source"]
+
+    def _build_chain(self):
         """
         使用 LCEL 构建 1.0 风格的 RAG 链
         """
         def log_rephrased_question(data):
-            logger.info(f"对话历史改写后的独立问题: {data}")
+            logger.debug("对话历史改写后的独立问题: %s", data)
             return data
         # 1. 问题重写子链 (Condense Question Chain)
         # 作用：把 (chat_history + input) -> 转换为独立的问题
@@ -107,7 +285,7 @@ class RAGEngine:
         ])
         
         # 这是一个微型的 LCEL 链：Prompt -> LLM -> String
-        condense_question_chain = rephrase_prompt | self.llm | StrOutputParser() 
+        condense_question_chain = rephrase_prompt | self._stage_llm("rewrite") | StrOutputParser() 
 
 
         # 2. 最终问答子链 (Answer Generation Chain)
@@ -124,43 +302,50 @@ class RAGEngine:
 
         # 3. 完整 LCEL 组合逻辑
         # 关键点：使用 RunnablePassthrough.assign 动态构建上下文数据流
-        full_rag_chain = (
+        retrieve_and_answer = (
             RunnablePassthrough.assign(
-                # 第一步：先通过重写链得到独立问题
-                standalone_question=condense_question_chain
-            )
-            | RunnableLambda(log_rephrased_question) # 记录中间结果
-            | RunnablePassthrough.assign(
                 # 第二步：用重写后的问题去检索文档，并格式化
-                 context=itemgetter("standalone_question") | self.retriever | self._format_docs
+                 context=itemgetter("standalone_question") | self.retriever | self._pack_docs | self._format_docs
+                 | self._observe_context("default")
             )
             | qa_prompt  # 第三步：将所有数据喂给问答 Prompt
-            | RunnableLambda(print_debug_prompt)
-            | self.llm   # 第四步：调用 LLM
+            | debug_runnable(print_debug_prompt) # 调试采样开启时才插入
+            | self._stage_llm("generation")   # 第四步：调用 LLM
             | StrOutputParser() # 第五步：解析输出
         )
 
+        full_rag_chain = (
+            RunnablePassthrough.assign(
+                # 第一步：先通过重写链得到独立问题（无历史时直接用原问题）
+                standalone_question=self._route_rewrite(condense_question_chain)
+            )
+            | RunnableLambda(log_rephrased_question) # 记录中间结果
+            | self._with_answer_cache("default", retrieve_and_answer) # 命中缓存则跳过检索与生成
+        )
+
         # 4. 封装记忆组件
         # 注意：RunnableWithMessageHistory 要求 input 和 chat_history 键名匹配
         return RunnableWithMessageHistory(
             full_rag_chain,
-            get_session_history,
+            self.history_store.get_session_history,
             input_messages_key="input",
             history_messages_key="chat_history",
         )
-    
 
-    def get_chain_with_source(self):
-        
-        
+
+    def _build_chain_with_source(self):
+        """构建带来源引用的 RAG 链"""
         # 1. 问题重写链 (保持不变)
         rephrase_prompt = ChatPromptTemplate.from_messages([
             ("system", "参考对话历史，将用户问题重写为独立的搜索查询。不要回答问题，只需重写。"),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}"),
         ])
-        condense_question_chain = rephrase_prompt| self.llm | StrOutputParser()| RunnableLambda(lambda x: debug_step(x, "重写后的问题"))
-        logger.info(f"condense_question_chain: {condense_question_chain}")
+        condense_question_chain = (
+            rephrase_prompt | self._stage_llm("rewrite") | StrOutputParser()
+            | debug_runnable(lambda x: debug_step(x, "重写后的问题"))
+        )
+        logger.debug(f"condense_question_chain: {condense_question_chain}")
         # 2. 增强版问答 Prompt
         # 明确要求 LLM 引用编号
         qa_system_prompt = (
@@ -178,34 +363,35 @@ class RAGEngine:
         ])
 
         # 3. 构建 LCEL 链
-        # 我们使用一个 dict 包装结果，以便同时返回 answer 和 context(docs)
-        def get_answer_and_sources(data):
-            # 这个函数接收最终组装好的数据字典
-            final_chain = qa_prompt | self.llm | StrOutputParser()| RunnableLambda(lambda x: debug_step(x, "最终回答"))
-            return {
-                "answer": (final_chain).invoke(data),
-                "context": data["raw_docs"] # 将原始文档列表传出
-            }
+        # 用 assign 追加 answer 字段（而不是在函数里 invoke 子链），
+        # 这样 astream 时会先吐出 raw_docs，再逐 token 吐出 answer
+        answer_chain = qa_prompt | self._stage_llm("generation") | StrOutputParser()
 
-        full_rag_chain = (
+        retrieve_and_answer = (
             RunnablePassthrough.assign(
-                standalone_question=condense_question_chain
-            )
-            | RunnablePassthrough.assign(
                 # 这一步检索出 raw_docs 列表，并生成格式化的 context 字符串
-                raw_docs=itemgetter("standalone_question") | self.retriever
+                raw_docs=itemgetter("standalone_question") | self.retriever | self._pack_docs
             )
-            | RunnableLambda(lambda x: debug_step(x, "检索后的完整字典")) # 观测检索结果
+            | debug_runnable(lambda x: debug_step(x, "检索后的完整字典")) # 观测检索结果（调试采样开启时）
             | RunnablePassthrough.assign(
                 context=lambda x: self._format_docs_with_sources(x["raw_docs"])
             )
-            | RunnableLambda(get_answer_and_sources) # 最终产出字典
+            | RunnablePassthrough.assign(context_tokens=lambda x: self._count_context_tokens(x["context"], "with_source"))
+            | RunnablePassthrough.assign(answer=answer_chain)
+            | RunnablePick(["answer", "raw_docs", "context_tokens"]) # 最终产出字典 {answer, raw_docs, context_tokens}
+        )
+
+        full_rag_chain = (
+            RunnablePassthrough.assign(
+                standalone_question=self._route_rewrite(condense_question_chain)
+            )
+            | self._with_answer_cache("with_source", retrieve_and_answer) # 命中缓存则跳过检索与生成
         )
 
         return RunnableWithMessageHistory(
             full_rag_chain,
-            get_session_history, # 引用你代码中定义的 get_session_history
+            self.history_store.get_session_history,
             input_messages_key="input",
             history_messages_key="chat_history",
-            # 注意：由于输出是字典，这里不再配置 output_messages_key 以便透传
-        )
\ No newline at end of file
+            output_messages_key="answer", # 输出是字典，指定写入历史的字段
+        )
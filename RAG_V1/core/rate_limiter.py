@@ -0,0 +1,378 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import httpx
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("RateLimiter")
+
+# 服务商限流或过载的状态码：触发并发上限收缩，并允许（在重试预算内）重试
+_THROTTLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimitExceeded(httpx.TimeoutException):
+    """在排队截止时间内没有拿到配额，请求被主动丢弃（继承 TimeoutException，与连接池超时同类处理）"""
+
+
+def is_overloaded(exc: BaseException) -> bool:
+    """判断异常（或其原因链）是否是限流器主动丢弃请求，SDK 可能把它包装成自己的异常类型"""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        if isinstance(exc, RateLimitExceeded):
+            return True
+        seen.add(id(exc))
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class TokenBucket:
+    """令牌桶：每分钟补充 per_minute 个令牌，最多积攒 burst_seconds 秒的量（调用方持锁）"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还需等待多少秒才能取出 amount 个令牌（单次超过桶容量的按容量计）"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RetryBudget:
+    """
+    全局重试预算：滑动窗口内的重试次数不超过正常请求数的 ratio 倍（另有少量保底配额），
+    避免过载时每个请求各自重试把压力放大数倍
+    """
+
+    def __init__(self, ratio: float = 0.1, min_retries: int = 3, window_seconds: float = 10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self._requests = deque()
+        self._retries = deque()
+
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window_seconds:
+                events.popleft()
+
+    def record_request(self, now: float):
+        self._requests.append(now)
+
+    def try_spend(self, now: float) -> bool:
+        self._trim(now)
+        if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+            return False
+        self._retries.append(now)
+        return True
+
+
+class _Waiter:
+    """排队中的一个请求：同步调用方用 threading.Event，异步调用方用所在事件循环的 asyncio.Event"""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = asyncio.Event() if loop else threading.Event()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:  # 事件循环已关闭，等待方也不存在了
+            pass
+
+
+class AdaptiveLimiter:
+    """
+    服务商调用的客户端限流器，同步（入库线程）与异步（问答链）调用共用：
+    - RPM / TPM 两个令牌桶控制请求速率与 token 速率
+    - AIMD 自适应并发：成功时并发上限缓慢加一，遇到 429/5xx 时减半
+    - 排队按先来先服务：只有队首尝试获取配额，槽位归还或队首离开时唤醒下一个，不轮询
+    - 排队等待超过 queue_timeout 的请求直接丢弃（RateLimitExceeded）
+    - 重试受全局 RetryBudget 约束
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float, max_concurrency: int, min_concurrency: int = 1,
+                 queue_timeout: float = 10.0, max_retries: int = 3, retry_budget: Optional[RetryBudget] = None):
+        self.name = name
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget or RetryBudget()
+        self._in_flight = 0
+        self._queue = deque()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "shed": 0, "throttled": 0, "retries": 0, "retries_denied": 0}
+
+    def _try_acquire(self, tokens: float) -> Optional[float]:
+        """
+        尝试占用一个并发槽位与令牌：成功返回 0；令牌不足返回需要等待的秒数；
+        并发槽位已满返回 None，等待归还槽位时唤醒（调用方持锁）
+        """
+        now = time.monotonic()
+        if self._in_flight >= int(self.limit):
+            return None
+        wait = max(self.request_bucket.wait_time(1, now), self.token_bucket.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self.request_bucket.take(1)
+        self.token_bucket.take(tokens)
+        self._in_flight += 1
+        self._stats["admitted"] += 1
+        return 0.0
+
+    def _shed(self, waited: float):
+        self._stats["shed"] += 1
+        logger.warning(f"[{self.name}] 排队 {waited:.1f}s 仍未获得配额，丢弃请求 "
+                       f"(并发上限 {int(self.limit)}, 排队 {len(self._queue)})")
+        raise RateLimitExceeded(f"{self.name} 调用排队超时，服务繁忙，请稍后重试")
+
+    def _poll(self, waiter: _Waiter, tokens: float, start: float) -> Optional[float]:
+        """
+        排在队首时尝试获取配额：成功返回 None，否则返回本轮最多等待的秒数；
+        超过排队截止时间则丢弃（调用方持锁）
+        """
+        waiter.event.clear()
+        wait = self._try_acquire(tokens) if self._queue[0] is waiter else None
+        if wait == 0:
+            return None
+        remaining = self.queue_timeout - (time.monotonic() - start)
+        if remaining <= 0:
+            self._shed(time.monotonic() - start)
+        return remaining if wait is None else min(wait, remaining)
+
+    def _leave(self, waiter: _Waiter):
+        """离开队列（拿到配额、被丢弃或被取消）；原本是队首时唤醒下一个（调用方持锁）"""
+        was_head = self._queue[0] is waiter
+        self._queue.remove(waiter)
+        if was_head and self._queue:
+            self._queue[0].wake()
+
+    def acquire(self, tokens: float):
+        start = time.monotonic()
+        waiter = _Waiter()
+        with self._lock:
+            self._queue.append(waiter)
+        try:
+            while True:
+                with self._lock:
+                    timeout = self._poll(waiter, tokens, start)
+                if timeout is None:
+                    return
+                waiter.event.wait(timeout)
+        finally:
+            with self._lock:
+                self._leave(waiter)
+
+    async def aacquire(self, tokens: float):
+        start = time.monotonic()
+        waiter = _Waiter(asyncio.get_running_loop())
+        with self._lock:
+            self._queue.append(waiter)
+        try:
+            while True:
+                with self._lock:
+                    timeout = self._poll(waiter, tokens, start)
+                if timeout is None:
+                    return
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._leave(waiter)
+
+    def release(self, throttled: bool, completed: bool = True):
+        """
+        请求结束时归还槽位并调整并发上限；
+        completed=False 表示请求被取消或中途出错，只归还槽位，不参与并发上限调整
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            if completed and throttled:
+                self._stats["throttled"] += 1
+                # 同一波 429 只收缩一次，避免并发上限瞬间跌到底
+                if now - self._last_decrease > 1.0:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._last_decrease = now
+                    logger.warning(f"[{self.name}] 服务商限流/过载，并发上限降至 {int(self.limit)}")
+            elif completed:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                self.retry_budget.record_request(now)
+            if self._queue:
+                self._queue[0].wake()
+
+    def should_retry(self, attempt: int) -> bool:
+        with self._lock:
+            if attempt >= self.max_retries:
+                return False
+            if not self.retry_budget.try_spend(time.monotonic()):
+                self._stats["retries_denied"] += 1
+                return False
+            self._stats["retries"] += 1
+            return True
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        return 0.5 * (2 ** attempt) * (1 + random.random())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": self._in_flight, "queue_depth": len(self._queue),
+                    "concurrency_limit": int(self.limit)}
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """流式响应读完/关闭后才归还并发槽位"""
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+def _release_once(limiter: AdaptiveLimiter, throttled: bool) -> Callable[[], None]:
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            limiter.release(throttled)
+    return release
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """在 httpx 传输层接入限流器：ModelFactory 的连接池都经过这里，LLM 与 Embedding 调用统一受控"""
+
+    def __init__(self, inner: httpx.BaseTransport, limiter: AdaptiveLimiter,
+                 estimate_tokens: Callable[[httpx.Request], float]):
+        self.inner = inner
+        self.limiter = limiter
+        self.estimate_tokens = estimate_tokens
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = self.estimate_tokens(request)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                response = self.inner.handle_request(request)
+            except httpx.TransportError:
+                self.limiter.release(throttled=True)
+                if not self.limiter.should_retry(attempt):
+                    raise
+            except BaseException:
+                # 其他异常（含中断）同样要归还槽位，否则 in_flight 永久泄漏
+                self.limiter.release(throttled=False, completed=False)
+                raise
+            else:
+                throttled = response.status_code in _THROTTLE_STATUS
+                try:
+                    retry = throttled and self.limiter.should_retry(attempt)
+                    if not retry:
+                        # 槽位交给响应流，读完/关闭时归还
+                        response.stream = _ReleasingStream(response.stream, _release_once(self.limiter, throttled))
+                        return response
+                    response.close()
+                except BaseException:
+                    self.limiter.release(throttled=throttled, completed=False)
+                    raise
+                self.limiter.release(throttled=True)
+            time.sleep(self.limiter.backoff(attempt))
+            attempt += 1
+
+    def close(self):
+        self.inner.close()
+
+
+class LimitedAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, limiter: AdaptiveLimiter,
+                 estimate_tokens: Callable[[httpx.Request], float]):
+        self.inner = inner
+        self.limiter = limiter
+        self.estimate_tokens = estimate_tokens
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = self.estimate_tokens(request)
+        attempt = 0
+        while True:
+            await self.limiter.aacquire(tokens)
+            try:
+                response = await self.inner.handle_async_request(request)
+            except httpx.TransportError:
+                self.limiter.release(throttled=True)
+                if not self.limiter.should_retry(attempt):
+                    raise
+            except BaseException:
+                # 客户端断开导致的 CancelledError 等同样要归还槽位，否则 in_flight 永久泄漏
+                self.limiter.release(throttled=False, completed=False)
+                raise
+            else:
+                throttled = response.status_code in _THROTTLE_STATUS
+                try:
+                    retry = throttled and self.limiter.should_retry(attempt)
+                    if not retry:
+                        # 槽位交给响应流，读完/关闭时归还
+                        response.stream = _AsyncReleasingStream(response.stream,
+                                                                _release_once(self.limiter, throttled))
+                        return response
+                    await response.aclose()
+                except BaseException:
+                    self.limiter.release(throttled=throttled, completed=False)
+                    raise
+                self.limiter.release(throttled=True)
+            await asyncio.sleep(self.limiter.backoff(attempt))
+            attempt += 1
+
+    async def aclose(self):
+        await self.inner.aclose()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("Reranker")
+
+# 重排序推理在独立线程中执行，超时后调用方可以先用初排结果返回
+_RERANK_WORKERS = 2
+_rerank_executor = ThreadPoolExecutor(max_workers=_RERANK_WORKERS, thread_name_prefix="rerank")
+# 在途推理数不超过线程数：线程全忙时直接使用初排结果，不再提交注定超时的排队任务
+_rerank_slots = threading.BoundedSemaphore(_RERANK_WORKERS)
+
+
+def _submit_rerank(fn, *args):
+    """提交重排序推理，线程全忙时返回 None"""
+    if not _rerank_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _rerank_executor.submit(fn, *args)
+    except BaseException:
+        _rerank_slots.release()
+        raise
+    future.add_done_callback(lambda _: _rerank_slots.release())
+    return future
+
+
+class CrossEncoderReranker:
+    """
+    本地 CPU 交叉编码器重排序（sentence-transformers CrossEncoder），
+    批量推理，并按 (query, 切片内容) 缓存打分结果。
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16, max_length: int = 512, cache_size: int = 10000):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("重排序需要安装 sentence-transformers: pip install sentence-transformers") from e
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        logger.info(f"重排序模型加载完成: {model_name}")
+
+    @staticmethod
+    def _key(query: str, doc: Document) -> str:
+        return hashlib.sha256(f"{query}\x00{doc.page_content}".encode("utf-8")).hexdigest()
+
+    def score(self, query: str, docs: List[Document]) -> List[float]:
+        """对每个候选切片打分，命中缓存的不再推理"""
+        keys = [self._key(query, d) for d in docs]
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+
+        missing = [(key, doc) for key, doc in zip(keys, docs) if key not in scores]
+        if missing:
+            pairs = [(query, doc.page_content) for _, doc in missing]
+            predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for (key, _), value in zip(missing, predicted):
+                    scores[key] = float(value)
+                    self._cache[key] = float(value)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [scores[key] for key in keys]
+
+    def rerank(self, query: str, docs: List[Document], k: int) -> List[Document]:
+        scores = self.score(query, docs)
+        ranked = sorted(zip(docs, scores), key=lambda item: item[1], reverse=True)
+        return [doc for doc, _ in ranked[:k]]
+
+
+class RerankRetriever(BaseRetriever):
+    """
+    先宽召回、再精排：base_retriever 召回 N 个候选，交叉编码器重排后保留前 k 个。
+    重排超过 timeout_ms 或推理线程全忙时退回初排顺序的前 k 个，保证延迟上限。
+    """
+
+    base_retriever: BaseRetriever
+    reranker: Any
+    k: int = 4
+    timeout_ms: float = 500
+
+    def _timed_rerank(self, query: str, docs: List[Document]):
+        start = time.perf_counter()
+        ranked = self.reranker.rerank(query, docs, self.k)
+        return ranked, (time.perf_counter() - start) * 1000
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        if len(candidates) <= 1:
+            return candidates
+        future = _submit_rerank(self._timed_rerank, query, candidates)
+        if future is None:
+            logger.warning("重排序线程全忙，使用初排结果")
+            return candidates[: self.k]
+        try:
+            ranked, cost = future.result(timeout=self.timeout_ms / 1000)
+            logger.debug(f"重排序 {len(candidates)} 个候选耗时 {cost:.1f}ms")
+            return ranked
+        except TimeoutError:
+            logger.warning(f"重排序超过 {self.timeout_ms}ms 预算，使用初排结果")
+            return candidates[: self.k]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = await self.base_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        if len(candidates) <= 1:
+            return candidates
+        future = _submit_rerank(self._timed_rerank, query, candidates)
+        if future is None:
+            logger.warning("重排序线程全忙，使用初排结果")
+            return candidates[: self.k]
+        try:
+            ranked, cost = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout_ms / 1000)
+            logger.debug(f"重排序 {len(candidates)} 个候选耗时 {cost:.1f}ms")
+            return ranked
+        except asyncio.TimeoutError:
+            logger.warning(f"重排序超过 {self.timeout_ms}ms 预算，使用初排结果")
+            return candidates[: self.k]
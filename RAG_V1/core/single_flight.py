@@ -0,0 +1,93 @@
+import asyncio
+from typing import AsyncIterator, Callable, Hashable
+
+from utils.logger import setup_logger
+
+
+logger = setup_logger("SingleFlight")
+
+
+class _Flight:
+    """一次正在进行的调用：保存已产出的全部分块，供中途加入的订阅者从头回放"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None  # 事件循环只持有 Task 的弱引用，需在这里保留强引用，避免执行中被回收
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def finish(self, error: BaseException = None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    async def subscribe(self) -> AsyncIterator:
+        i = 0
+        while True:
+            changed = self._changed
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    """
+    请求合并（single-flight）：同一个 key 同时只执行一次，期间到达的相同请求订阅同一份流式输出。
+    实际执行放在独立的 Task 中，任何一个订阅者断开都不会中断其他订阅者；
+    执行结束后立即移除，之后的请求由答案缓存负责命中。
+    只在单个事件循环（单个 worker 进程）内生效。
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """factory() 返回实际执行的异步迭代器，只有第一个请求（leader）会调用它"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            self._stats["leaders"] += 1
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+        else:
+            self._stats["followers"] += 1
+            logger.debug(f"合并相同的进行中请求: {key[1]!r}（当前 {flight.subscribers + 1} 个订阅者）")
+        flight.subscribers += 1
+        try:
+            async for chunk in flight.subscribe():
+                yield chunk
+        finally:
+            flight.subscribers -= 1
+
+    async def _produce(self, key: Hashable, flight: _Flight, factory: Callable[[], AsyncIterator]):
+        try:
+            async for chunk in factory():
+                flight.publish(chunk)
+            flight.finish()
+        except asyncio.CancelledError:
+            flight.finish(RuntimeError("请求已取消"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._flights)}
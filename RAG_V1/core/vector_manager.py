@@ -1,9 +1,20 @@
+import asyncio
 import sqlite3
 import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from langchain_chroma import Chroma
 from .model_factory import ModelFactory
 from .config import settings
+from .hybrid_retriever import BM25Index, HybridRetriever
+from .reranker import CrossEncoderReranker, RerankRetriever
+from .vector_search import VectorSearchRetriever, query_result_to_docs
+from .metrics import observe_stage, stage_timer
+from .hnsw_index import hnsw_configuration, sync_hnsw_params
 from utils.logger import setup_logger
 
 
@@ -12,47 +23,241 @@ logger = setup_logger("VectorManager")
 class VectorManager:
     def __init__(self):
         self.embeddings = ModelFactory.get_embedding()
-        self.vector_store = Chroma(
-            collection_name=settings.collection_name,
-            embedding_function=self.embeddings,
-            persist_directory=settings.chroma_persist_dir
-        )
+        os.makedirs(settings.chroma_persist_dir, exist_ok=True)
+        if settings.chroma_host:
+            # 多 worker 部署：所有进程通过 Chroma Server 读写，避免多个进程同时写本地持久化目录
+            import chromadb
+            self.vector_store = Chroma(
+                collection_name=settings.collection_name,
+                embedding_function=self.embeddings,
+                client=chromadb.HttpClient(host=settings.chroma_host, port=settings.chroma_port),
+                collection_configuration=hnsw_configuration(),
+            )
+        else:
+            self.vector_store = Chroma(
+                collection_name=settings.collection_name,
+                embedding_function=self.embeddings,
+                persist_directory=settings.chroma_persist_dir,
+                collection_configuration=hnsw_configuration(),
+            )
+        # HNSW 参数只在新建 collection 时生效，已有 collection 在这里同步可在线修改的部分
+        sync_hnsw_params(self.vector_store._collection)
         # 初始化 SQLite 账本
         self.db_path = os.path.join(settings.chroma_persist_dir, "file_registry.db")
         self._init_metadata_db()
+        # 知识库变更监听者（如答案缓存），在增删文档后以 collection 名回调
+        self._change_listeners = []
+        # 知识库版本号（存在 SQLite 中，多进程共享），用于发现其他 worker 对知识库的修改
+        self.corpus_version = self._read_corpus_version()
+        self._last_sync = time.monotonic()
+        # 混合检索模式下维护与 Chroma 同步的 BM25 倒排索引（启动时全量加载，之后增量更新）
+        self.lexical_index = None
+        if settings.retrieval_mode == "hybrid":
+            self.lexical_index = BM25Index.from_collection(self.vector_store._collection)
+        # 重排序模型较大，首次获取检索器时才加载
+        self.reranker = None
+        # 异步检索：连接 Chroma Server 时使用原生异步客户端（首次检索时创建），
+        # 本地持久化模式则在独立的有界线程池中查询，不占用事件循环默认线程池
+        self._async_collection = None
+        self._async_collection_lock = None
+        self._search_executor = ThreadPoolExecutor(max_workers=settings.vector_search_threads,
+                                                   thread_name_prefix="vector-search")
+        # 其他 worker 修改知识库后，BM25 全量重建在后台单线程执行，问答请求不等待
+        self._reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="corpus-sync")
+        self._reload_future = None
+        # 保护 corpus_version 与 _reload_future：请求线程、入库线程与重建线程都会读写
+        self._reload_lock = threading.Lock()
         logger.info(f"向量库初始化成功，存储路径: {settings.chroma_persist_dir}")
 
     def _init_metadata_db(self):
         with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL") # 多进程并发读写
             conn.execute('''CREATE TABLE IF NOT EXISTS file_records 
                 (file_hash TEXT PRIMARY KEY, file_name TEXT, upload_time TEXT, chunk_count INTEGER)''')
+            conn.execute("CREATE TABLE IF NOT EXISTS corpus_meta (key TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO corpus_meta VALUES ('version', 0)")
+
+    def _read_corpus_version(self) -> int:
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT value FROM corpus_meta WHERE key = 'version'").fetchone()[0]
+
+    def add_change_listener(self, callback):
+        """注册知识库变更回调，callback(collection_name)"""
+        self._change_listeners.append(callback)
+
+    def _notify_change(self):
+        """本进程修改了知识库：版本号 +1（通知其他 worker），并回调本进程的监听者"""
+        with self._reload_lock:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("BEGIN IMMEDIATE")  # 读取与递增之间不允许其他进程插入修改
+                before = conn.execute("SELECT value FROM corpus_meta WHERE key = 'version'").fetchone()[0]
+                conn.execute("UPDATE corpus_meta SET value = value + 1 WHERE key = 'version'")
+            missed = before != self.corpus_version
+            self.corpus_version = before + 1
+        if missed:
+            # 递增前其他 worker 已修改过知识库，且本进程尚未同步：直接采用新版本号会永远错过这次修改
+            logger.info(f"知识库在本进程同步前已被其他进程修改 (版本 {before})，后台重建 BM25 索引")
+            self._schedule_reload()
+        self._fire_listeners()
+
+    def sync_corpus_version(self):
+        """
+        检查其他 worker 是否修改了知识库（最多每 corpus_sync_interval_seconds 秒查一次），
+        若有则让缓存失效并在后台重建 BM25 索引（重建完成前沿用旧索引，请求不等待）
+        """
+        now = time.monotonic()
+        if now - self._last_sync < settings.corpus_sync_interval_seconds:
+            return
+        self._last_sync = now
+        with self._reload_lock:
+            version = self._read_corpus_version()
+            if version == self.corpus_version:
+                return
+            logger.info(f"检测到知识库已被其他进程修改 (版本 {self.corpus_version} -> {version})，同步本地状态")
+            self.corpus_version = version
+        self._schedule_reload()
+        self._fire_listeners()
+
+    def _schedule_reload(self):
+        """在后台重建 BM25 索引，完成后原地替换；已有排队中的重建时不重复提交（它会读到最新数据）"""
+        if self.lexical_index is None:
+            return
+        with self._reload_lock:
+            pending = self._reload_future
+            if pending is not None and not pending.running() and not pending.done():
+                return
+            self._reload_future = self._reload_executor.submit(self._reload_lexical_index)
+
+    def _reload_lexical_index(self):
+        try:
+            self.lexical_index.reload(self.vector_store._collection)
+        except Exception as e:
+            logger.error(f"BM25 索引重建失败: {e}", exc_info=True)
+            return
+        # 重建期间生成的答案可能基于旧索引，再让缓存失效一次
+        self._fire_listeners()
+
+    def _fire_listeners(self):
+        for callback in self._change_listeners:
+            try:
+                callback(settings.collection_name)
+            except Exception as e:
+                logger.error(f"知识库变更回调执行失败: {e}")
 
-    def add_documents(self, documents: list, file_info: dict, batch_size: int = 100):
-        """增强版入库：记录哈希元数据"""
+    def add_documents(self, documents: list, file_info: dict, batch_size: int = 100, progress_callback=None):
+        """
+        增强版入库：记录哈希元数据
+        progress_callback(chunks_done) 在每批写入 Chroma 后回调，用于上报进度
+        """
+        return self.add_document_stream([documents], file_info, batch_size, progress_callback)
+
+    def add_document_stream(self, chunk_batches, file_info: dict, batch_size: int = 100, progress_callback=None):
+        """
+        流式入库：chunk_batches 是逐批产出切片列表的可迭代对象（如按页窗口惰性解析的生成器），
+        每批向量化写入后即释放，内存占用与文档大小无关
+        """
         file_hash = file_info['file_hash']
         logger.info(f"开始处理文件入库: {file_info['file_name']}, Hash: {file_hash}")
 
-
+        total = 0
         try:
             # 写入前先清理旧哈希（幂等性）
-            self.vector_store.delete(where={"file_hash": file_hash})
-            
-            for doc in documents:
-                doc.metadata["file_hash"] = file_hash
-                doc.metadata["file_name"] = file_info['file_name']
-
-            for i in range(0, len(documents), batch_size):
-                batch = documents[i : i + batch_size]
-                self.vector_store.add_documents(batch)
-                
+            self._delete_chunks(file_hash)
+
+            start = time.perf_counter()
+            for documents in chunk_batches:
+                for doc in documents:
+                    doc.metadata["file_hash"] = file_hash
+                    doc.metadata["file_name"] = file_info['file_name']
+                offset = total
+                self._embed_and_store(
+                    documents, batch_size,
+                    (lambda done: progress_callback(offset + done)) if progress_callback else None,
+                )
+                total += len(documents)
+            if total == 0:
+                raise ValueError("没有可入库的切片（文件解析失败或内容为空）")
+            elapsed = time.perf_counter() - start
+            throughput = total / elapsed if elapsed > 0 else 0.0
+            logger.info(f"向量化写入完成: {total} 个切片, 耗时 {elapsed:.2f}s, 吞吐 {throughput:.1f} chunks/s")
+
             with sqlite3.connect(self.db_path) as conn:
                 conn.execute("INSERT OR REPLACE INTO file_records VALUES (?, ?, ?, ?)",
                     (file_hash, file_info['file_name'], 
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(documents)))
-            logger.info(f"文件 {file_info['file_name']} 入库成功，共 {len(documents)} 个切片")
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"), total))
+            logger.info(f"文件 {file_info['file_name']} 入库成功，共 {total} 个切片")
+            return {"chunks": total, "seconds": round(elapsed, 3), "chunks_per_second": round(throughput, 1)}
         except Exception as e:
             logger.error(f"文件 {file_info['file_name']} 入库失败: {str(e)}")
+            # 已写入的部分切片没有账本记录指向它们，回滚掉，失败的入库不留下任何切片；
+            # 强制重新入库时旧切片已被删除，旧账本记录也要一并删除，否则之后的普通上传会被误判为"未变化"而跳过
+            try:
+                self._delete_chunks(file_hash)
+                with sqlite3.connect(self.db_path) as conn:
+                    conn.execute("DELETE FROM file_records WHERE file_hash = ?", (file_hash,))
+            except Exception as cleanup_error:
+                logger.error(f"清理文件 {file_info['file_name']} 的残留切片失败: {cleanup_error}")
             raise e
+        finally:
+            # 无论成功与否旧切片都已被删除，知识库均已变化
+            self._notify_change()
+
+    def _embed_with_backoff(self, texts: list) -> list:
+        """
+        调用 Embedding 接口。启用客户端限流器时重试完全交给传输层（受全局重试预算约束），
+        这里不再叠加一层独立重试，否则过载时会把重试量放大数倍，主动丢弃的请求也会被重新排队；
+        未启用时遇到限流/网络抖动按指数退避重试
+        """
+        if settings.limiter_enabled:
+            return self.embeddings.embed_documents(texts)
+        for attempt in range(settings.embedding_max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == settings.embedding_max_retries:
+                    raise
+                delay = settings.embedding_backoff_base * (2 ** attempt) * (1 + random.random())
+                logger.warning(f"Embedding 调用失败 ({e})，{delay:.1f}s 后第 {attempt + 1} 次重试")
+                time.sleep(delay)
+
+    def _embed_and_store(self, documents: list, write_batch_size: int, progress_callback=None):
+        """
+        并发向量化 + 批量写入：
+        按服务商单次请求上限切成小批，用有界线程池并发计算向量，
+        按顺序收集结果，攒够 write_batch_size 条后连同向量一次性写入 Chroma（不再二次计算）
+        """
+        embed_batch = settings.embedding_batch_size
+        batches = [documents[i : i + embed_batch] for i in range(0, len(documents), embed_batch)]
+        collection = self.vector_store._collection
+        buffer_docs, buffer_vectors = [], []
+        done = 0
+
+        def flush():
+            nonlocal done
+            ids = [str(uuid.uuid4()) for _ in buffer_docs]
+            collection.upsert(
+                ids=ids,
+                embeddings=buffer_vectors,
+                documents=[d.page_content for d in buffer_docs],
+                metadatas=[d.metadata for d in buffer_docs],
+            )
+            if self.lexical_index is not None:
+                self.lexical_index.add(ids, buffer_docs)
+            done += len(buffer_docs)
+            if progress_callback:
+                progress_callback(done)
+            buffer_docs.clear()
+            buffer_vectors.clear()
+
+        with ThreadPoolExecutor(max_workers=settings.embedding_concurrency) as pool:
+            texts = ([d.page_content for d in batch] for batch in batches)
+            for batch, vectors in zip(batches, pool.map(self._embed_with_backoff, texts)):
+                buffer_docs.extend(batch)
+                buffer_vectors.extend(vectors)
+                if len(buffer_docs) >= write_batch_size:
+                    flush()
+        if buffer_docs:
+            flush()
 
     def get_file_list(self):
         """获取已上传文件列表"""
@@ -61,16 +266,110 @@ class VectorManager:
             cursor = conn.execute("SELECT * FROM file_records ORDER BY upload_time DESC")
             return [dict(row) for row in cursor.fetchall()]
 
+    def get_file_record(self, file_hash: str):
+        """按哈希查询已入库文件记录，不存在返回 None"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM file_records WHERE file_hash = ?", (file_hash,)).fetchone()
+            return dict(row) if row else None
+
+    def get_indexed_hashes(self, file_hashes: list) -> set:
+        """批量查询哪些哈希已经入库（供同步客户端跳过未变化的文件）"""
+        indexed = set()
+        with sqlite3.connect(self.db_path) as conn:
+            # SQLite 单条语句参数上限 999，分批查询
+            for i in range(0, len(file_hashes), 900):
+                batch = file_hashes[i : i + 900]
+                placeholders = ",".join("?" * len(batch))
+                cursor = conn.execute(
+                    f"SELECT file_hash FROM file_records WHERE file_hash IN ({placeholders})", batch
+                )
+                indexed.update(row[0] for row in cursor)
+        return indexed
+
+    def _delete_chunks(self, file_hash: str):
+        """删除某个文件在向量库（及 BM25 索引）中的全部切片"""
+        self.vector_store.delete(where={"file_hash": file_hash})
+        if self.lexical_index is not None:
+            self.lexical_index.remove_file(file_hash)
+
     def delete_file_by_hash(self, file_hash: str):
         """双删逻辑"""
-        self.vector_store.delete(where={"file_hash": file_hash})
+        self._delete_chunks(file_hash)
         with sqlite3.connect(self.db_path) as conn:
             conn.execute("DELETE FROM file_records WHERE file_hash = ?", (file_hash,))
+        self._notify_change()
+
+    def search_by_vector(self, vector: list, k: int):
+        """按查询向量检索最相似的 k 个切片（同步）"""
+        with stage_timer("vector_search"):
+            result = self.vector_store._collection.query(
+                query_embeddings=[vector], n_results=k, include=["documents", "metadatas"]
+            )
+        return query_result_to_docs(result)
+
+    def search(self, query: str, k: int):
+        with stage_timer("query_embed"):
+            vector = self.embeddings.embed_query(query)
+        return self.search_by_vector(vector, k)
+
+    async def _get_async_collection(self):
+        if self._async_collection is None:
+            if self._async_collection_lock is None:
+                self._async_collection_lock = asyncio.Lock()
+            async with self._async_collection_lock:
+                if self._async_collection is None:
+                    import chromadb
+                    client = await chromadb.AsyncHttpClient(host=settings.chroma_host, port=settings.chroma_port)
+                    self._async_collection = await client.get_collection(settings.collection_name)
+        return self._async_collection
+
+    async def asearch(self, query: str, k: int):
+        """异步检索：查询向量化走异步 HTTP，检索走 Chroma 异步客户端或独立线程池"""
+        start = time.perf_counter()
+        vector = await self.embeddings.aembed_query(query)
+        observe_stage("query_embed", time.perf_counter() - start)
+        if settings.chroma_host:
+            collection = await self._get_async_collection()
+            start = time.perf_counter()
+            result = await collection.query(
+                query_embeddings=[vector], n_results=k, include=["documents", "metadatas"]
+            )
+            observe_stage("vector_search", time.perf_counter() - start)
+            return query_result_to_docs(result)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._search_executor, self.search_by_vector, vector, k)
+
+    def _build_base_retriever(self, k: int):
+        """第一阶段召回：纯向量，或向量 + BM25 混合"""
+        if self.lexical_index is None:
+            return VectorSearchRetriever(vector_manager=self, k=k)
+        # 混合检索：两路各召回 fetch_k 个候选，RRF 融合后取 k 个
+        fetch_k = max(settings.hybrid_fetch_k, k)
+        return HybridRetriever(
+            vector_retriever=VectorSearchRetriever(vector_manager=self, k=fetch_k),
+            lexical_index=self.lexical_index,
+            k=k,
+            fetch_k=fetch_k,
+            rrf_k=settings.hybrid_rrf_k,
+            lexical_timeout_ms=settings.hybrid_lexical_timeout_ms,
+        )
 
     def get_retriever(self):
-        logger.info(f"获取检索器，K={settings.top_k}")
-        return self.vector_store.as_retriever(
-            # search_type="similarity_score_threshold",
-             search_type="similarity", # 暂时不用 threshold 模式
-            search_kwargs={"k": settings.top_k}
-        )
\ No newline at end of file
+        # 启用 token 预算组装时多取一些候选，由预算决定最终进入 Prompt 的数量
+        k = settings.context_candidate_k if settings.context_token_budget > 0 else settings.top_k
+        logger.info(f"获取检索器，模式={settings.retrieval_mode}, 重排序={settings.rerank_enabled}, K={k}")
+        if not settings.rerank_enabled:
+            return self._build_base_retriever(k)
+        # 宽召回 rerank_fetch_k 个候选，本地交叉编码器重排后只保留 k 个送入 Prompt
+        if self.reranker is None:
+            self.reranker = CrossEncoderReranker(
+                settings.rerank_model,
+                batch_size=settings.rerank_batch_size,
+            )
+        return RerankRetriever(
+            base_retriever=self._build_base_retriever(settings.rerank_fetch_k),
+            reranker=self.reranker,
+            k=k,
+            timeout_ms=settings.rerank_timeout_ms,
+        )
@@ -0,0 +1,38 @@
+from typing import Any, List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def query_result_to_docs(result: dict) -> List[Document]:
+    """把 Chroma collection.query 的结果（单条查询）转换为 Document 列表"""
+    ids = result["ids"][0]
+    documents = result["documents"][0]
+    metadatas = result["metadatas"][0] or [{}] * len(ids)
+    return [
+        Document(page_content=text, metadata=meta or {}, id=doc_id)
+        for doc_id, text, meta in zip(ids, documents, metadatas)
+        if text is not None
+    ]
+
+
+class VectorSearchRetriever(BaseRetriever):
+    """
+    纯向量检索器，替代 vector_store.as_retriever()：
+    同步调用走 VectorManager.search，异步调用走 VectorManager.asearch（原生异步向量化 + 检索），
+    不再依赖 LangChain 默认的 run_in_executor 兜底。
+    """
+
+    vector_manager: Any
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.vector_manager.search(query, self.k)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self.vector_manager.asearch(query, self.k)
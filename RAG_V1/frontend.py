@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 import os
 import uuid
+import json
+import time
 
 # --- 配置区 ---
 # 指向你刚才启动的 FastAPI 地址
@@ -24,19 +26,37 @@ with st.sidebar:
     
     if st.button("🚀 开始处理文档"):
         if uploaded_file is not None:
-            with st.spinner("正在解析并入库，请稍候..."):
+            with st.spinner("正在上传，请稍候..."):
                 try:
                     # 将 Streamlit 的文件对象发送给 FastAPI
                     files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
                     response = requests.post(f"{BASE_URL}/upload", files=files)
-                    
-                    if response.status_code == 200:
-                        st.success(f"✅ {uploaded_file.name} 处理成功！")
-                        st.json(response.json())
-                    else:
-                        st.error(f"❌ 上传失败: {response.text}")
                 except Exception as e:
+                    response = None
                     st.error(f"连接后端失败: {e}")
+
+            if response is not None and response.status_code == 200:
+                result = response.json()
+                if result.get("job_id"):
+                    # 后台入库任务：轮询进度直到结束
+                    progress = st.progress(0.0, text="排队中...")
+                    while True:
+                        job = requests.get(f"{BASE_URL}/jobs/{result['job_id']}").json()
+                        if job["status"] not in ("queued", "running"):
+                            break
+                        total = job["chunks_total"] or 0
+                        ratio = job["chunks_done"] / total if total else 0.0
+                        progress.progress(min(ratio, 1.0), text=f"{job['stage']}: {job['chunks_done']}/{total} 个切片")
+                        time.sleep(1)
+                    progress.empty()
+                    result = job
+                if result["status"] in ("success", "skipped: unchanged"):
+                    st.success(f"✅ {uploaded_file.name} 处理成功！")
+                    st.json(result)
+                else:
+                    st.error(f"❌ 入库失败: {result.get('error')}")
+            elif response is not None:
+                st.error(f"❌ 上传失败: {response.text}")
         else:
             st.warning("请先选择一个文件")
 
@@ -54,6 +74,27 @@ with st.sidebar:
             st.rerun()
 # --- 主界面：聊天窗口 ---
 
+def iter_sse_tokens(response, sources: list):
+    """
+    解析后端的 SSE 流：token 事件逐个 yield 给 st.write_stream，
+    sources 事件写入传入的 sources 列表，error 事件抛出异常
+    """
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            event = None
+            continue
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data = json.loads(line[len("data:"):].strip())
+            if event == "token":
+                yield data["content"]
+            elif event == "sources":
+                sources.extend(data)
+            elif event == "error":
+                raise RuntimeError(data.get("detail", "未知错误"))
+
 # 初始化聊天历史
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -70,20 +111,18 @@ if prompt := st.chat_input("请输入您关于文档的问题..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # 2. 调用后端接口获取回答
+    # 2. 调用后端流式接口，边接收边渲染
     with st.chat_message("assistant"):
-        with st.spinner("思考中..."):
-            try:
-                response = requests.post(
-                    f"{BASE_URL}/chat/v2",
-                    json={"query": prompt, "session_id": st.session_state.session_id},
-                    timeout=60 # RAG 有时检索较慢，设置较长超时
-                )
-                
+        try:
+            sources = []
+            with requests.post(
+                f"{BASE_URL}/chat/v2/stream",
+                json={"query": prompt, "session_id": st.session_state.session_id},
+                stream=True,
+                timeout=(5, 60) # (连接超时, 两个数据块之间的最大间隔)
+            ) as response:
                 if response.status_code == 200:
-                    answer = response.json().get("answer", "未获取到回答")
-                    sources = response.json().get("sources", [])
-                    st.markdown(answer)
+                    answer = st.write_stream(iter_sse_tokens(response, sources))
                     # 如果有来源，展示来源标签
                     if sources:
                         with st.expander("查看参考来源"):
@@ -91,11 +130,9 @@ if prompt := st.chat_input("请输入您关于文档的问题..."):
                                 # 这里的 s['index'] 完美对应回答里的 [1], [2]
                                 st.write(f"**[{s['index']}] {s['file_name']}**")
                                 st.caption(f"内容摘要: {s['content']}")
-                    else:
-                        pass
                     # 保存到历史
                     st.session_state.messages.append({"role": "assistant", "content": answer})
                 else:
                     st.error(f"后端返回错误: {response.status_code}")
-            except Exception as e:
-                st.error(f"请求失败: {e}")
\ No newline at end of file
+        except Exception as e:
+            st.error(f"请求失败: {e}")
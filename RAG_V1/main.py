@@ -1,14 +1,20 @@
 import os
 import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from fastapi.concurrency import run_in_threadpool
 import uuid
-from langchain_core.runnables import RunnableLambda
-from core.rag_engine import RAGEngine
-from core.vector_manager import VectorManager
-from utils.document_processor import DocumentProcessor
+import time
+from core.config import settings
+from core.container import AppContainer
+from core.model_factory import ModelFactory
+from core.rate_limiter import is_overloaded
+from core.metrics import REQUEST_SECONDS, render_metrics
+from utils.logger import get_log_levels, set_log_level
 from utils.hash_utils import calculate_file_hash
 from pathlib import Path  # 引入 Path 处理路径
 from utils.logger import setup_logger
@@ -16,17 +22,52 @@ logger = setup_logger("MainAPI")
 
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 业务组件在 worker 进程启动时创建（而不是导入时），多 worker 部署时每个进程各一套
+    app.state.container = AppContainer()
+    yield
+    app.state.container.close()
+    await ModelFactory.aclose()
+
 # 初始化 FastAPI 应用
 app = FastAPI(
     title="企业级 RAG 助手 API",
     description="基于 LangChain + 阿里百炼 + ChromaDB 的 RAG 基础架构",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
-# 初始化业务组件
-# 注意：在实际生产中，建议使用依赖注入或在 app 启动事件中初始化
-rag_engine = RAGEngine()
-doc_processor = DocumentProcessor()
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """记录每个接口的总耗时；流式响应在最后一个分块发送完毕后才计时结束"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    # 只按路由模板打标签（/files/{file_hash} 而不是具体哈希），避免标签基数膨胀
+    endpoint = getattr(route, "path", "unmatched")
+    if endpoint == "/metrics":
+        return response
+    body = response.body_iterator
+
+    async def timed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, str(response.status_code))
+
+    response.body_iterator = timed_body()
+    return response
+
+def get_container(request: Request) -> AppContainer:
+    """依赖注入：获取当前进程的组件容器"""
+    return request.app.state.container
+
+def synced_container(container: AppContainer = Depends(get_container)) -> AppContainer:
+    """问答接口使用：先同步其他 worker 对知识库的修改（BM25 索引、答案缓存）"""
+    container.vector_manager.sync_corpus_version()
+    return container
 
 # --- 数据模型定义 ---
 class ChatRequest(BaseModel):
@@ -40,16 +81,48 @@ class ChatResponse(BaseModel):
     answer: str
     status: str
     sources: List[SourceItem] = []  # 新增来源文件列表字段
+    context_tokens: Optional[int] = None  # 本次送入 Prompt 的参考内容 token 数（估算）
+
+def build_sources(raw_docs) -> list:
+    """把检索到的 Document 列表转换成前端展示用的来源列表，编号与回答中的 [n] 对应"""
+    return [
+        {
+            "index": i + 1,
+            "file_name": doc.metadata.get("file_name", "未知文件"),
+            "content": doc.page_content[:100] + "..." # 给前端展示预览
+        }
+        for i, doc in enumerate(raw_docs)
+    ]
+
+def error_response(e: Exception) -> HTTPException:
+    """服务商配额排队超时返回 503（客户端可稍后重试），其余错误返回 500"""
+    if is_overloaded(e):
+        return HTTPException(status_code=503, detail="服务繁忙，请稍后重试", headers={"Retry-After": "1"})
+    return HTTPException(status_code=500, detail=str(e))
+
+def sse_event(event: str, data) -> str:
+    """按 Server-Sent Events 格式编码一条消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 # --- 接口定义 ---
 
 @app.get("/")
 async def root():
     return {"message": "RAG API 运行中", "docs_url": "/docs"}
 
+class LogLevelRequest(BaseModel):
+    level: str
+    logger: Optional[str] = None  # 为空时调整所有记录器
+
+class HashCheckRequest(BaseModel):
+    hashes: List[str]
+
 @app.post("/upload", summary="上传文档并自动入库")
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(file: UploadFile = File(...), force: bool = False,
+                          container: AppContainer = Depends(get_container)):
     """
-    接收上传的文件(PDF/DOCX/TXT)，保存到临时目录，解析并存入向量库。
+    接收上传的文件(PDF/DOCX/TXT)，保存到临时目录，登记后台入库任务并立即返回 job_id。
+    若相同内容（哈希一致）已入库则直接跳过，force=true 时强制重新入库。
     """
      # 1. 确定基础目录（使用绝对路径更稳健）
     # Path(__file__).parent 拿到 main.py 所在的文件夹
@@ -72,52 +145,88 @@ async def upload_document(file: UploadFile = File(...)):
         # 1. 保存文件到本地
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
-        
-        # # 2. 调用文档处理器进行解析和入库
-        # # 这里为了演示方便，直接调用解析单文件的逻辑
-        # docs = doc_processor.load_file(file_path)
-        # if not docs:
-        #     raise HTTPException(status_code=400, detail="文件解析失败或格式不支持")
-        
-        # splits = doc_processor.text_splitter.split_documents(docs)
-        # doc_processor.vector_manager.add_documents(splits)
-
-        # return {"message": f"文件 {file.filename} 已成功处理并入库", "chunks": len(splits)}
-
-        logger.info("文件保存成功，开始处理...")
-        # 将耗时的同步任务交给线程池处理，防止阻塞 API
-        def process_task():
-            file_hash = calculate_file_hash(file_path)
-            docs = doc_processor.load_file(file_path)
-            splits = doc_processor.text_splitter.split_documents(docs)
-            doc_processor.vector_manager.add_documents(splits, {"file_hash": file_hash, "file_name": file.filename})
-            return len(splits)
-
-        chunks_count = await run_in_threadpool(process_task)
-        return {"status": "success", "chunks": chunks_count}
+
+        file_hash = await run_in_threadpool(calculate_file_hash, file_path)
+        # 内容未变化的文件不再重复解析和向量化
+        record = None if force else container.vector_manager.get_file_record(file_hash)
+        if record:
+            logger.info(f"文件 {file.filename} 已入库 (Hash: {file_hash})，跳过处理")
+            os.remove(file_path)
+            return {"status": "skipped: unchanged", "chunks": record["chunk_count"], "file_hash": file_hash}
+
+        # 2. 登记后台入库任务，立即返回 job_id，由 GET /jobs/{job_id} 查询进度
+        #    临时文件由任务执行完毕后清理
+        job_id = container.ingest_jobs.submit(str(file_path), file.filename, file_hash)
+        return {"status": "queued", "job_id": job_id, "file_hash": file_hash}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"上传处理失败: {str(e)}")
-    finally:
-        # 清理临时文件（可选）
         if os.path.exists(file_path):
             os.remove(file_path)
+        raise HTTPException(status_code=500, detail=f"上传处理失败: {str(e)}")
+
+@app.get("/jobs/{job_id}", summary="查询入库任务进度")
+async def get_job(job_id: str, container: AppContainer = Depends(get_container)):
+    job = container.ingest_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
 @app.get("/files")
-async def list_files():
-    return doc_processor.vector_manager.get_file_list()
+async def list_files(container: AppContainer = Depends(get_container)):
+    return container.vector_manager.get_file_list()
+
+@app.post("/files/check", summary="批量查询哪些文件哈希已入库")
+async def check_files(request: HashCheckRequest, container: AppContainer = Depends(get_container)):
+    indexed = await run_in_threadpool(container.vector_manager.get_indexed_hashes, request.hashes)
+    return {
+        "indexed": [h for h in request.hashes if h in indexed],
+        "missing": [h for h in request.hashes if h not in indexed],
+    }
 
 @app.delete("/files/{file_hash}")
-async def delete_file(file_hash: str):
-    doc_processor.vector_manager.delete_file_by_hash(file_hash)
+async def delete_file(file_hash: str, container: AppContainer = Depends(get_container)):
+    container.vector_manager.delete_file_by_hash(file_hash)
     return {"status": "success"}
 
 
+@app.get("/stats", summary="运行统计")
+async def stats(container: AppContainer = Depends(get_container)):
+    rag_engine = container.rag_engine
+    answer_cache = rag_engine.answer_cache
+    return {
+        "worker_pid": os.getpid(),
+        "corpus_version": container.vector_manager.corpus_version,
+        "rewrite": rag_engine.get_rewrite_stats(),
+        "history": rag_engine.history_store.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "embedding_cache": getattr(container.vector_manager.embeddings, "stats", dict)(),
+        "limiters": ModelFactory.limiter_stats(),
+        "coalescing": rag_engine.single_flight.stats() if rag_engine.single_flight else None,
+    }
+
+@app.get("/metrics", summary="Prometheus 指标（本 worker 进程）")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/logging/level", summary="查看各记录器的日志级别（本 worker 进程）")
+async def log_levels():
+    return get_log_levels()
+
+@app.put("/logging/level", summary="运行时调整日志级别（本 worker 进程）")
+async def update_log_level(request: LogLevelRequest):
+    if request.level.upper() not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+        raise HTTPException(status_code=400, detail=f"不支持的日志级别: {request.level}")
+    if request.logger and request.logger not in get_log_levels():
+        raise HTTPException(status_code=404, detail=f"记录器不存在: {request.logger}")
+    set_log_level(request.level, request.logger)
+    return get_log_levels()
+
 @app.post("/chat", response_model=ChatResponse, summary="RAG 问答对话")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, container: AppContainer = Depends(synced_container)):
     """
     输入问题，检索向量库，生成答案。
     """
     try:
-        chain = rag_engine.get_chain()
+        chain = container.rag_engine.get_chain()
         # 使用 ainvoke 进行异步调用
         response = await chain.ainvoke({"input": request.query}, config={"configurable": {"session_id": request.session_id}})
         return {"answer": response, "status": "success"}
@@ -126,44 +235,91 @@ async def chat(request: ChatRequest):
         logger.error(f"Chat Error: {str(e)}", exc_info=True)
         import traceback
         traceback.print_exc() 
-        raise HTTPException(status_code=500, detail=str(e))
+        raise error_response(e)
 
 
 
 
 @app.post("/chat/v2", response_model=ChatResponse)
-async def chatv2(request: ChatRequest):
+async def chatv2(request: ChatRequest, container: AppContainer = Depends(synced_container)):
     try:
-        chain = rag_engine.get_chain_with_source()
+        chain = container.rag_engine.get_chain_with_source()
         # 调用链
         result = await chain.ainvoke(
             {"input": request.query},
             config={"configurable": {"session_id": request.session_id}}
         )
         
-        # 提取来源文件名 (去重)
-        raw_docs = result.get("context", [])
-        # 方案：构建一个有序的、包含索引的来源列表
-        sources = []
-        for i, doc in enumerate(raw_docs):
-            sources.append({
-                "index": i + 1,
-                "file_name": doc.metadata.get("file_name", "未知文件"),
-                "content": doc.page_content[:100] + "..." # 可选：给前端展示预览
-            })
+        # 构建一个有序的、包含索引的来源列表
+        sources = build_sources(result.get("raw_docs", []))
         
         # 最终回答拼接或返回（这里可以只返回 answer，或者把来源列表也包进去）
         # 我们将 source_files 放入 ChatResponse (需先在 Pydantic 中定义)
         return {
             "answer": result["answer"],
             "status": "success",
-            "sources": sources # 建议给 ChatResponse 增加一个 sources 字段
+            "sources": sources, # 建议给 ChatResponse 增加一个 sources 字段
+            "context_tokens": result.get("context_tokens"),
         }
     except Exception as e:
         logger.error(f"Chat Error: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+        raise error_response(e)
+
+@app.post("/chat/stream", summary="RAG 问答对话（SSE 流式输出）")
+async def chat_stream(request: ChatRequest, container: AppContainer = Depends(synced_container)):
+    """
+    与 /chat 相同，但以 SSE 方式逐 token 推送回答：
+    event: token -> {"content": "..."}，结束时 event: done，出错时 event: error
+    """
+    chain = container.rag_engine.get_chain()
+    config = {"configurable": {"session_id": request.session_id}}
+
+    async def event_generator():
+        try:
+            async for token in chain.astream({"input": request.query}, config=config):
+                if token:
+                    yield sse_event("token", {"content": token})
+            yield sse_event("done", {"status": "success"})
+        except Exception as e:
+            logger.error(f"Chat Stream Error: {e}", exc_info=True)
+            yield sse_event("error", {"detail": error_response(e).detail})
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
+@app.post("/chat/v2/stream", summary="带来源的 RAG 问答（SSE 流式输出）")
+async def chatv2_stream(request: ChatRequest, container: AppContainer = Depends(synced_container)):
+    """
+    与 /chat/v2 相同，但先推送 event: sources，再逐 token 推送 event: token，
+    结束时 event: done，出错时 event: error
+    """
+    chain = container.rag_engine.get_chain_with_source()
+    config = {"configurable": {"session_id": request.session_id}}
+
+    async def event_generator():
+        try:
+            context_tokens = None
+            async for chunk in chain.astream({"input": request.query}, config=config):
+                # 检索结果先于回答到达，只会出现一次
+                if "raw_docs" in chunk:
+                    yield sse_event("sources", build_sources(chunk["raw_docs"]))
+                if "context_tokens" in chunk:
+                    context_tokens = chunk["context_tokens"]
+                if chunk.get("answer"):
+                    yield sse_event("token", {"content": chunk["answer"]})
+            yield sse_event("done", {"status": "success", "context_tokens": context_tokens})
+        except Exception as e:
+            logger.error(f"Chat Stream Error: {e}", exc_info=True)
+            yield sse_event("error", {"detail": error_response(e).detail})
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 # --- 启动配置 ---
 if __name__ == "__main__":
     import uvicorn
     # host="127.0.0.1" 仅限本地访问，"0.0.0.0" 允许外网/局域网访问
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    # 多 worker 时需以导入字符串方式启动，每个 worker 进程通过 lifespan 各自初始化组件
+    if settings.api_workers > 1:
+        uvicorn.run("main:app", host="127.0.0.1", port=8000, workers=settings.api_workers)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -1,7 +1,9 @@
 import os
+import argparse
 import logging
 import time
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List
 from pathlib import Path
 
 from langchain_community.document_loaders import PyPDFLoader, UnstructuredWordDocumentLoader, TextLoader
@@ -15,71 +17,178 @@ from .hash_utils import calculate_file_hash # 引入新增工具
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".doc", ".txt"}
+
+
+def build_text_splitter() -> RecursiveCharacterTextSplitter:
+    """按配置创建切片器"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+        length_function=len,
+        add_start_index=True, # 记录切片在原文中的位置，方便溯源
+    )
+
+
+def _create_loader(file_path: str):
+    """根据文件后缀选择不同的加载器，不支持的格式返回 None"""
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext == ".pdf":
+        return PyPDFLoader(file_path)
+    elif ext in [".docx", ".doc"]:
+        return UnstructuredWordDocumentLoader(file_path)
+    elif ext == ".txt":
+        return TextLoader(file_path, encoding='utf-8')
+    logger.warning(f"暂不支持的文件格式: {ext}")
+    return None
+
+
+def iter_documents(file_path: str) -> Iterator[Document]:
+    """惰性加载：PDF 逐页产出，不会一次性把整份文档读入内存"""
+    loader = _create_loader(file_path)
+    if loader is None:
+        return
+    file_name = os.path.basename(file_path)
+    for doc in loader.lazy_load():
+        doc.metadata["upload_time"] = time.time() # 记录上传时间
+        doc.metadata["file_name"] = file_name
+        yield doc
+
+
+def iter_split_batches(file_path: str, text_splitter, page_window: int) -> Iterator[List[Document]]:
+    """
+    生成器流水线：lazy_load -> 每攒满 page_window 页切一次片 -> 产出切片批次。
+    PDF 本身就是逐页切片，按窗口切分与整份切分结果一致，但内存中最多只保留一个窗口的页面。
+    """
+    window = []
+    for doc in iter_documents(file_path):
+        window.append(doc)
+        if len(window) >= page_window:
+            yield text_splitter.split_documents(window)
+            window = []
+    if window:
+        yield text_splitter.split_documents(window)
+
+
+def load_file(file_path: str) -> List[Document]:
+    """一次性加载整份文档（小文件/调试用，大文件请走 iter_split_batches）"""
+    try:
+        return list(iter_documents(file_path))
+    except Exception as e:
+        logger.error(f"解析文件 {file_path} 出错: {e}")
+        return []
+
+
+def _parse_and_split(file_path: str) -> List[Document]:
+    """进程池任务：在子进程中解析并切片单个文件（不接触向量库）"""
+    splitter = build_text_splitter()
+    splits = []
+    for batch in iter_split_batches(file_path, splitter, settings.ingest_page_window):
+        splits.extend(batch)
+    return splits
+
+
 class DocumentProcessor:
-    def __init__(self):
+    def __init__(self, vector_manager: VectorManager = None):
         # 初始化切片器
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap,
-            length_function=len,
-            add_start_index=True, # 记录切片在原文中的位置，方便溯源
-        )
-        self.vector_manager = VectorManager()
+        self.text_splitter = build_text_splitter()
+        # 与 RAGEngine 共用同一个 VectorManager，保证 BM25 索引、缓存失效等状态一致
+        self.vector_manager = vector_manager or VectorManager()
 
     def load_file(self, file_path: str) -> List[Document]:
         """根据文件后缀选择不同的加载器"""
-        ext = os.path.splitext(file_path)[-1].lower()
-        try:
-            if ext == ".pdf":
-                loader = PyPDFLoader(file_path)
-            elif ext in [".docx", ".doc"]:
-                loader = UnstructuredWordDocumentLoader(file_path)
-            elif ext == ".txt":
-                loader = TextLoader(file_path, encoding='utf-8')
-            else:
-                logger.warning(f"暂不支持的文件格式: {ext}")
-                return []
-            docs = loader.load()
-            for doc in docs:
-                upload_time = time.time()
-                # print(upload_time)
-                doc.metadata["upload_time"] = upload_time # 记录上传时间
-                doc.metadata["file_name"] = os.path.basename(file_path)
-            return docs
-        except Exception as e:
-            logger.error(f"解析文件 {file_path} 出错: {e}")
-            return []
-
-    def process_directory(self, dir_path: str):
-        """批量处理目录下所有文档"""
+        return load_file(file_path)
+
+    def ingest_file(self, file_path: str, file_name: str, file_hash: str, progress_callback=None) -> dict:
+        """
+        单文件完整入库流程：解析 -> 切片 -> 向量化写入
+        progress_callback(stage, **fields) 用于上报当前阶段与进度
+        """
+        def report(stage, **fields):
+            if progress_callback:
+                progress_callback(stage, **fields)
+
+        def with_totals(batches):
+            # 流式解析无法预知全文切片数，chunks_total 随页窗口逐步累加
+            total = 0
+            while True:
+                report("splitting", chunks_total=total)
+                batch = next(batches, None)
+                if batch is None:
+                    return
+                total += len(batch)
+                report("embedding", chunks_total=total)
+                yield batch
+
+        report("parsing")
+        # 按页窗口流式解析、切片、向量化，峰值内存与文档页数无关
+        batches = iter_split_batches(file_path, self.text_splitter, settings.ingest_page_window)
+        return self.vector_manager.add_document_stream(
+            with_totals(batches),
+            {"file_hash": file_hash, "file_name": file_name},
+            progress_callback=lambda done: report("embedding", chunks_done=done),
+        )
+
+    def process_directory(self, dir_path: str, workers: int = None, force: bool = False) -> dict:
+        """
+        并行批量处理目录下所有文档：
+        子进程负责解析 + 切片，主进程按文件完成顺序逐个写入向量库（带正确的哈希元数据）。
+        同时在途的文件数不超过 2 * workers，内存占用与目录大小无关。
+        """
         path = Path(dir_path)
         if not path.exists():
             logger.error(f"目录不存在: {dir_path}")
-            return
+            return {}
+
+        workers = workers or os.cpu_count() or 1
+        summary = {"indexed": 0, "skipped": 0, "failed": 0, "chunks": 0}
+        start = time.perf_counter()
+        pending = {}
+
+        def drain():
+            """等待至少一个文件解析完成并写入向量库"""
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file, file_hash = pending.pop(future)
+                try:
+                    splits = future.result()
+                    if not splits:
+                        raise ValueError("文件解析失败或内容为空")
+                    self.vector_manager.add_documents(splits, {"file_hash": file_hash, "file_name": file.name})
+                    summary["indexed"] += 1
+                    summary["chunks"] += len(splits)
+                except Exception as e:
+                    logger.error(f"文件 {file} 入库失败: {e}")
+                    summary["failed"] += 1
 
-        all_docs = []
-        # 支持递归查找
-        for file in path.rglob("*.*"):
-            if file.suffix in [".pdf", ".docx", ".txt"]:
+        # 支持递归查找，rglob 是惰性的，不会一次性列出整个目录
+        files = (f for f in path.rglob("*") if f.is_file() and f.suffix.lower() in SUPPORTED_EXTENSIONS)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for file in files:
+                file_hash = calculate_file_hash(str(file))
+                if not force and self.vector_manager.get_file_record(file_hash):
+                    summary["skipped"] += 1
+                    continue
                 logger.info(f"正在解析: {file.name}")
-                docs = self.load_file(str(file))
-                all_docs.extend(docs)
-
-        if not all_docs:
-            logger.info("没有找到可处理的文档。")
-            return
-
-        # 执行切片
-        logger.info(f"正在对 {len(all_docs)} 个文档进行切片...")
-        splits = self.text_splitter.split_documents(all_docs)
-        
-        # 存入向量库
-        logger.info(f"正在将 {len(splits)} 条片段存入向量库...")
-        self.vector_manager.add_documents(splits)
-        logger.info("文档入库完成！")
-
-# 脚本独立运行入口
+                pending[pool.submit(_parse_and_split, str(file))] = (file, file_hash)
+                if len(pending) >= 2 * workers:
+                    drain()
+            while pending:
+                drain()
+
+        elapsed = time.perf_counter() - start
+        summary["seconds"] = round(elapsed, 2)
+        logger.info(f"目录入库完成: {summary}，吞吐 {summary['chunks'] / elapsed if elapsed else 0:.1f} chunks/s")
+        return summary
+
+# 脚本独立运行入口（在 RAG_V1 目录下执行）：
+#   python -m utils.document_processor ./docs --workers 8
 if __name__ == "__main__":
-    # 使用示例：将 docs 文件夹下的文件全部入库
+    parser = argparse.ArgumentParser(description="批量将目录下的文档（PDF/DOCX/TXT）并行解析并入库")
+    parser.add_argument("dir", nargs="?", default="./docs", help="待入库的目录，默认 ./docs")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数，默认 CPU 核数")
+    parser.add_argument("--force", action="store_true", help="忽略哈希记录，强制重新入库")
+    args = parser.parse_args()
+
     processor = DocumentProcessor()
-    processor.process_directory("./docs")
\ No newline at end of file
+    processor.process_directory(args.dir, workers=args.workers, force=args.force)
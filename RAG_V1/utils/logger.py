@@ -1,39 +1,169 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Optional
 
-def setup_logger(name: str):
-    """
-    配置全局日志句柄
-    """
+from core.config import settings
+
+_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+
+# setup_logger 创建过的记录器，重新配置日志时统一替换 handler
+_loggers = {}
+_lock = threading.Lock()
+_state = {"handlers": None, "listener": None}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON，便于日志系统采集与检索"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "location": f"{record.filename}:{record.lineno}",
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """按比例采样 WARNING 以下的日志，警告和错误总是保留"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 标准实现会把异常堆栈拼进 message；这里只合并参数并单独保留堆栈文本，
+        # 时间、位置等格式化由后台线程按各 handler 的 formatter 完成
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _build_handlers(log_format: str) -> list:
     # 1. 创建日志目录
     log_dir = Path(__file__).parent.parent / "logs"
     log_dir.mkdir(exist_ok=True)
     log_file = log_dir / "rag_system.log"
 
-    # 2. 创建记录器
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    # 2. 定义格式
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(_TEXT_FORMAT)
+
+    # 3. 文件输出 - 轮转（每个文件10MB，最多保留5个）
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+
+    # 4. 控制台输出
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    return [file_handler, console_handler]
+
+
+def _stop_listener():
+    listener = _state["listener"]
+    if listener is not None:
+        listener.stop()  # 把队列中剩余的日志写完
+        _state["listener"] = None
+
+
+def configure_logging(async_mode: Optional[bool] = None, log_format: Optional[str] = None):
+    """
+    (重新)配置日志输出，默认取 settings.log_async / settings.log_format：
+    - 异步模式：业务线程只把日志放入内存队列，由 QueueListener 后台线程写文件与控制台
+    - 同步模式：直接挂 RotatingFileHandler 与 StreamHandler（旧行为）
+    """
+    async_mode = settings.log_async if async_mode is None else async_mode
+    log_format = log_format or settings.log_format
+    with _lock:
+        _stop_listener()
+        old = _state["handlers"] or []
+        handlers = _build_handlers(log_format)
+        if async_mode:
+            listener = QueueListener(queue.SimpleQueue(), *handlers, respect_handler_level=True)
+            listener.start()
+            _state["listener"] = listener
+            _state["handlers"] = [_QueueHandler(listener.queue)]
+        else:
+            _state["handlers"] = handlers
+        for logger in _loggers.values():
+            for handler in old:
+                logger.removeHandler(handler)
+            for handler in _state["handlers"]:
+                logger.addHandler(handler)
+        for handler in old:
+            if not isinstance(handler, QueueHandler):
+                handler.close()
+
+
+def set_log_level(level: str, name: Optional[str] = None):
+    """运行时调整日志级别；name 为空时调整所有记录器"""
+    with _lock:
+        targets = [_loggers[name]] if name else list(_loggers.values())
+    for logger in targets:
+        logger.setLevel(level.upper())
+
+
+def get_log_levels() -> dict:
+    with _lock:
+        return {name: logging.getLevelName(logger.level) for name, logger in _loggers.items()}
+
+
+def setup_logger(name: str):
+    """
+    配置全局日志句柄
+    """
+    if _state["handlers"] is None:
+        configure_logging()
+
+    with _lock:
+        # 如果已经创建过则直接返回（防止重复添加 handler）
+        if name in _loggers:
+            return _loggers[name]
 
-    # 如果已经有 handler 则不再添加（防止重复打印）
-    if not logger.handlers:
-        # 3. 定义格式
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-        )
+        # 创建记录器
+        logger = logging.getLogger(name)
+        logger.setLevel(settings.log_level.upper())
+        for handler in _state["handlers"]:
+            logger.addHandler(handler)
+        rate = settings.log_sample_rates.get(name)
+        if rate is not None and rate < 1:
+            logger.addFilter(SamplingFilter(rate))
+        _loggers[name] = logger
+    return logger
 
-        # 4. 文件输出 - 轮转（每个文件10MB，最多保留5个）
-        file_handler = RotatingFileHandler(
-            log_file, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8'
-        )
-        file_handler.setFormatter(formatter)
 
-        # 5. 控制台输出
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
+def _after_fork_in_child():
+    # fork 出的子进程（如入库进程池）不会继承父进程的后台写日志线程，且子进程以 os._exit 退出，
+    # 队列中剩余的日志会丢失，因此子进程改用同步输出
+    global _lock
+    _lock = threading.Lock()
+    if _state["listener"] is not None:
+        _state["listener"] = None
+        configure_logging(async_mode=False)
 
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
 
-    return logger
\ No newline at end of file
+atexit.register(_stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
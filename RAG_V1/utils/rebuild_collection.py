@@ -0,0 +1,78 @@
+import argparse
+import time
+from datetime import datetime
+
+import chromadb
+
+from core.config import settings
+from core.hnsw_index import copy_collection, hnsw_configuration
+from .logger import setup_logger
+
+
+logger = setup_logger("RebuildCollection")
+
+
+def create_client():
+    """与 VectorManager 相同的连接方式：配置了 chroma_host 时连接 Chroma Server，否则打开本地持久化目录"""
+    if settings.chroma_host:
+        return chromadb.HttpClient(host=settings.chroma_host, port=settings.chroma_port)
+    return chromadb.PersistentClient(path=settings.chroma_persist_dir)
+
+
+def rebuild_collection(client, name: str, configuration: dict, batch_size: int = 5000, keep_backup: bool = True) -> dict:
+    """
+    用新的 HNSW 参数重建 collection：新建临时 collection，原样复制 id / 向量 / 原文 / 元数据（不重新向量化），
+    条数校验一致后把旧 collection 改名为备份、临时 collection 改为原名。
+    切换期间不能有写入，需在停服后执行；切片 id 不变，file_registry.db 与 BM25 索引无需改动。
+    """
+    source = client.get_collection(name)
+    suffix = datetime.now().strftime("%Y%m%d%H%M%S")
+    temp_name, backup_name = f"{name}_rebuild_{suffix}", f"{name}_backup_{suffix}"
+    # 保留 langchain 等写入的业务元数据，去掉旧版以 hnsw: 开头的索引参数，避免与新配置冲突
+    metadata = {k: v for k, v in (source.metadata or {}).items() if not k.startswith("hnsw:")} or None
+    target = client.create_collection(temp_name, configuration=configuration, metadata=metadata,
+                                      embedding_function=None)
+
+    start = time.perf_counter()
+    batch_size = min(batch_size, client.get_max_batch_size())
+
+    def report(done, total):
+        elapsed = time.perf_counter() - start
+        logger.info(f"已复制 {done}/{total} 条向量 ({done / elapsed if elapsed else 0:.0f} 条/s)")
+
+    try:
+        copied = copy_collection(source, target, batch_size, progress_callback=report)
+        if target.count() != source.count():
+            raise RuntimeError(f"复制后条数不一致: 原 {source.count()}，新 {target.count()}")
+    except Exception:
+        client.delete_collection(temp_name)
+        raise
+
+    source.modify(name=backup_name)
+    target.modify(name=name)
+    if not keep_backup:
+        client.delete_collection(backup_name)
+    summary = {"collection": name, "vectors": copied, "seconds": round(time.perf_counter() - start, 2),
+               "backup": backup_name if keep_backup else None, "configuration": configuration["hnsw"]}
+    logger.info(f"collection 重建完成: {summary}")
+    return summary
+
+
+# 脚本独立运行入口（在 RAG_V1 目录下执行，需先停止 API 服务；未指定的参数取 settings.hnsw_*，
+# 通过命令行修改参数后请同步更新 .env 中的 HNSW_*，否则服务启动时会提示参数不一致）：
+#   python -m utils.rebuild_collection --space cosine --m 32 --construction-ef 200
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="用新的 HNSW 参数重建向量 collection（复制已有向量，不重新向量化）")
+    parser.add_argument("--collection", default=settings.collection_name)
+    parser.add_argument("--space", choices=["l2", "cosine", "ip"], default=None)
+    parser.add_argument("--m", type=int, default=None, help="每个节点的最大邻居数")
+    parser.add_argument("--construction-ef", type=int, default=None)
+    parser.add_argument("--search-ef", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批复制的条数")
+    parser.add_argument("--drop-backup", action="store_true", help="重建成功后删除旧 collection（默认保留为备份）")
+    args = parser.parse_args()
+
+    configuration = hnsw_configuration(space=args.space, m=args.m, construction_ef=args.construction_ef,
+                                       search_ef=args.search_ef)
+    rebuild_collection(create_client(), args.collection, configuration,
+                       batch_size=args.batch_size, keep_backup=not args.drop_backup)